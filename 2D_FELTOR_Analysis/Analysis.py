@@ -1,13 +1,26 @@
 from netCDF4           import Dataset
 from json              import loads
 from scipy.integrate   import simps
-from scipy.signal      import csd
+from scipy.signal      import csd, get_window
 from scipy.io          import savemat
-from numpy             import tile, copy, ndim, shape, arange, roll, sqrt, conjugate
-from numpy             import correlate, average, empty, array_equal, squeeze, transpose
-from numpy             import gradient, angle, absolute, sum, ndarray, pi, log, gradient
-from matplotlib.pyplot import pcolormesh, show, plot, colorbar, title, savefig
-from scipy.constants   import e, m_e, m_p, m_n
+from numpy             import copy, ndim, shape, arange, roll, sqrt, conjugate
+from numpy             import average, empty, array_equal, squeeze, transpose
+from numpy             import gradient, angle, absolute, sum, ndarray, pi
+from numpy             import asarray, concatenate, zeros, identity, tensordot, iscomplexobj
+from numpy             import atleast_1d, moveaxis, inf, array, prod, multiply, add
+from numpy             import cumsum, clip, where, searchsorted, exp, outer, diff, allclose, argsort
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.fft         import rfft, irfft, fft, ifft, next_fast_len, rfftfreq, fftfreq
+from matplotlib.pyplot import pcolormesh, show, plot, colorbar, savefig
+from scipy.constants   import e, m_p, m_n
+from warnings          import warn
+from Fields            import Lazy, Field, Derived
+from Quadrature        import Quadrature
+from Derivatives       import Derivative
+from Cache             import Sidecar
+from Segments          import Concatenated
+from Instrument        import timed, count
+from Statistics        import Accumulator, merged
 
 ## CONSTANTS
 m_i   = m_p + m_n
@@ -15,6 +28,9 @@ T_old = 25; R_old = 1.65; B_old = 1.9
 alpha_old = 0.000274
 constant  = alpha_old * (R_old **  2) * (T_old ** (-5/2)) * B_old
 
+## Invariants saved by the simulation in energy_time, with their dissipation in name_diss
+invariant_names = ['mass', 'entropy', 'kinetic', 'curvature']
+
 
 class Analyse ():
     '''
@@ -22,12 +38,50 @@ class Analyse ():
     to run it one must introduce the name of the output File
     '''
 
-    def __init__ (self, File_name, Access_Mode = 'r', input_model = False, dimensions = False, fields = False, get_everything = True, integrate_fields = False, crop = 1, parallel = False):
+    @timed('Analyse')
+    def __init__ (self, File_name, Access_Mode = 'r', input_model = False, dimensions = False, fields = False, get_everything = True, integrate_fields = False, crop = 1, parallel = False, lazy = False, memory = 2 ** 30, quadrature = True, cache = None, invariants = False, dtype = None):
         '''
         Open the data and extract some important parameters
         Also calculate the Center of Mass
+        With lazy = True the fields are not loaded, they are read from the file
+        by blocks of time steps when they are used, keeping at most memory bytes
+        of each field in RAM (see Fields.py)
+        The spatial integrals use the exact quadrature of the DG grid (see Quadrature.py),
+        with quadrature = False they are done with simps as before
+        With cache = True (or the directory to use) the diagnostics computed are saved
+        in a sidecar file, and loaded from there the next time (see Cache.py)
+        File_name can be a list with the outputs of a restarted simulation, they are
+        analysed as a single one along the time (see Segments.py)
+        With parallel = True (or an MPI communicator) the fields are lazy and every
+        rank reads and integrates its own part of the time steps, the results are
+        joined so all the ranks get the same values as in serial
+        With invariants = True the invariants saved by the simulation are read
+        (see read_invariants), Analyse.monitor opens the file only for them
+        The fields are kept with the type dtype (e.g. float32 to use half of the
+        memory), the one of the file by default
         '''
-        self.Data  = Dataset(File_name, Access_Mode, format="NETCDF4", parallel = parallel)
+        self.comm = None
+        if parallel:
+            from mpi4py import MPI
+            self.comm = MPI.COMM_WORLD if parallel is True else parallel
+            lazy      = True
+
+        ## Reading, every rank opens the file by itself (no parallel HDF5 needed)
+        shared = {'parallel': True, 'comm': self.comm} if parallel and Access_Mode != 'r' else {}
+        if type(File_name) in [list, tuple]:
+            self.Data = Concatenated(File_name, Access_Mode, **shared)
+        else:
+            self.Data = Dataset(File_name, Access_Mode, format="NETCDF4", **shared)
+        self.memory = memory
+        self.dtype  = dtype
+        self.crop   = crop
+        self.quadrature = None
+        self.cache  = None
+        ## Prefix of the names in the sidecar, for the diagnostics of fields with other conventions
+        self.namespace = ''
+        if cache:
+            self.cache = Sidecar(File_name, cache if type(cache) == str else None, crop = crop, quadrature = quadrature,
+                                 dtype = str(asarray(0., dtype).dtype))
         if input_model or get_everything:
             self.input = loads(self.Data.inputfile)
             self.find_model()
@@ -37,7 +91,8 @@ class Analyse ():
             self.Ny   = self.input['n_out'] * self.input['Ny_out']
             self.time = copy(self.Data['time'][:])
             self.nt   = len(self.time)
-            if self.nt < 2:
+            ## Without fields (e.g. to follow the run with the invariants) a single output is enough
+            if self.nt < 2 and (fields or get_everything):
                 raise ValueError('The field contains only the initial conditions')
 
 
@@ -45,16 +100,116 @@ class Analyse ():
             self.lx, self.ly = self.input['lx'],        self.input['ly']
             self.dt  = (self.time[-1] - self.time[0]) / self.nt
 
+            if quadrature:
+                self.quadrature = Quadrature.from_input(self.input)
+                if not self.quadrature.matches(self.x, self.y):
+                    warn('The coordinates in the file are not the nodes of the DG grid, simps will be used')
+                    self.quadrature = None
+
+            ## Derivatives of the potential, spectral in the periodic directions
+            self.derivative_x = Derivative.from_input(self.input, 'x')
+            self.derivative_y = Derivative.from_input(self.input, 'y')
+            if not (self.derivative_x.matches(self.x) and self.derivative_y.matches(self.y)):
+                self.derivative_x, self.derivative_y = None, None
+
         if fields or get_everything:
-            nb, sign = (0, -1) if 'complete' not in File_name.lower() else (self.input['nb'], 1)
-            self.ions      = copy(self.Data['ions'][::crop]).transpose((0, 2, 1)) + nb
-            self.potential = sign * copy(self.Data['potential'][::crop]).transpose((0, 2, 1))
-            self.v_r       = -gradient(self.potential, self.y, axis = 2)
-            self.vorticity = copy(self.Data['vorticity'][::crop]).transpose((0, 2, 1))
+            names    = File_name if type(File_name) in [list, tuple] else [File_name]
+            nb, sign = (0, -1) if not any('complete' in name.lower() for name in names) else (self.input['nb'], 1)
+            if lazy:
+                self.ions      = Field(self.Data['ions'],      crop, offset = nb, memory = memory, dtype = dtype)
+                self.potential = Field(self.Data['potential'], crop, sign = sign, memory = memory, dtype = dtype)
+                self.vorticity = Field(self.Data['vorticity'], crop, memory = memory, dtype = dtype)
+            else:
+                self.ions      = self.load('ions',      crop, offset = nb)
+                self.potential = self.load('potential', crop, sign = sign)
+                self.vorticity = self.load('vorticity', crop)
+            ## The velocities are only computed, block by block, when they are used
+            self.v_r = self.velocity('r')
+            self.v_y = self.velocity('y')
+            self.v_E = self.velocity('abs')
+
+        if invariants:
+            self.read_invariants()
 
         if (dimensions and fields and integrate_fields) or get_everything:
-            self.Mass      = self.integrate(self.ions, crop = crop) / (self.lx * self.ly)
-            self.Potential = self.integrate(self.potential, crop = crop) / (self.lx * self.ly)
+            self.Mass, self.Potential = self.cached(['Mass', 'Potential'], lambda:
+                                                    [self.integrate(self.ions, crop = crop) / (self.lx * self.ly),
+                                                     self.integrate(self.potential, crop = crop) / (self.lx * self.ly)])
+
+    @classmethod
+    def monitor(cls, File_name, **kwargs):
+        '''
+        Open the output only to follow the run: the input, the coordinates and
+        the invariants, the fields are never read. It works from the first time
+        steps, before the second output of the fields is written.
+        '''
+        return cls(File_name, input_model = True, dimensions = True, fields = False, get_everything = False,
+                   invariants = True, **kwargs)
+
+    @timed()
+    def read_invariants(self):
+        '''
+        Read the invariants the simulation saves at every time step, in energy_time:
+        the dictionaries invariants and dissipation have the mass, entropy, kinetic and
+        curvature energy and their dissipation. From them it gets the change of the
+        mass, dMass_dt, and of the energy (entropy + kinetic), dEnergy_dt, and their
+        residuals, which are the difference with the dissipation, as the simulation
+        checks its accuracy (they should be close to 0).
+        '''
+        self.energy_time = copy(self.Data['energy_time'][:])
+        self.invariants  = {name: copy(self.Data[name][:])           for name in invariant_names}
+        self.dissipation = {name: copy(self.Data[f'{name}_diss'][:]) for name in invariant_names}
+        if len(self.energy_time) < 2:
+            raise ValueError('The invariants contain only the initial conditions')
+
+        self.Energy     = self.invariants['entropy'] + self.invariants['kinetic']
+        self.dMass_dt   = gradient(self.invariants['mass'], self.energy_time)
+        self.dEnergy_dt = gradient(self.Energy, self.energy_time)
+        self.mass_residual   = self.dMass_dt   - self.dissipation['mass']
+        self.energy_residual = self.dEnergy_dt - (self.dissipation['entropy'] + self.dissipation['kinetic'])
+
+    def cached(self, names, function):
+        '''
+        Get the diagnostics names from the sidecar cache of the output, if they
+        are not there (or there is no cache) they are computed with function,
+        which gives them as a list in the same order, and saved. The names are
+        kept in the sidecar after namespace, so the diagnostics of fields read with
+        other conventions (as the ones of GIF_modules.Analyzed) are not mixed.
+        '''
+        if self.cache == None:
+            return function()
+
+        keys   = [self.namespace + name for name in names]
+
+        ## Under MPI the root decides, so all the ranks compute (collectively) or none
+        values = self.cache.load() if self.comm == None or self.comm.Get_rank() == 0 else {}
+        found  = [values[key] for key in keys] if all(key in values for key in keys) else None
+        if self.comm != None:
+            found = self.comm.bcast(found, root = 0)
+        if found != None:
+            return found
+
+        results = function()
+        if self.comm == None or self.comm.Get_rank() == 0:
+            self.cache.save(dict(zip(keys, results)))
+        return results
+
+    def local_range(self, nt):
+        '''
+        The positions of the nt time steps given to this rank in parallel
+        '''
+        if self.comm == None:
+            return range(nt)
+        size, rank = self.comm.Get_size(), self.comm.Get_rank()
+        return range(rank * nt // size, (rank + 1) * nt // size)
+
+    def gather(self, local):
+        '''
+        Join along the time the pieces computed by every rank in parallel
+        '''
+        if self.comm == None:
+            return local
+        return concatenate(self.comm.allgather(local))
 
     def find_model(self):
         '''
@@ -75,19 +230,28 @@ class Analyse ():
             if pos + 2 < len(model):
                 self.model += model[pos + 2:]
 
-    def CM(self):
+    @timed()
+    def CM(self, spread = False):
         '''
         Function to calculate the Center of Mass of the system for all the time steps
         The Center of Mass is a 2D vector, for that reason we obtain 2 coordinate, X and Y,
         separately
+        It is the ratio of the first and zeroth moments of the ions, computed frame
+        by frame (see moments). With spread, the size of the blob, sigma_x and
+        sigma_y, is also calculated from the second moments.
         '''
 
-        X_mat = tile(self.x.reshape(self.Nx, 1), self.Ny)
-        Y_mat = tile(self.y.reshape(self.Ny, 1), self.Nx).transpose()
+        names = ['X_CM', 'Y_CM'] + (['sigma_x', 'sigma_y'] if spread else [])
+        def center():
+            moments = self.moments(self.ions, second = spread)
+            return [moments[name] for name in names]
 
-        self.X_CM = self.integrate(X_mat * self.ions) / (self.lx * self.ly * self.Mass)
-        self.Y_CM = self.integrate(Y_mat * self.ions) / (self.lx * self.ly * self.Mass)
+        values = self.cached(names, center)
+        self.X_CM, self.Y_CM = values[:2]
+        if spread:
+            self.sigma_x, self.sigma_y = values[2:]
 
+    @timed()
     def V_CM(self):
         '''
         Function to calculate the velocity of the Center of Mass of the system
@@ -99,10 +263,153 @@ class Analyse ():
         except the boundaries, which uses V = (x_i - x_i-1) / (t_i - t_i-1).
         '''
 
-        self.V_CM_x = gradient(self.X_CM, self.time)
-        self.V_CM_y = gradient(self.Y_CM, self.time)
+        if not hasattr(self, 'X_CM'):
+            self.CM()
+        self.V_CM_x, self.V_CM_y = self.cached(['V_CM_x', 'V_CM_y'], lambda:
+                                               [gradient(self.X_CM, self.time), gradient(self.Y_CM, self.time)])
 
-    def integrate(self, variable, dim_integral = 2, axis = -1, typ = 't', indep_vars = None, crop = 1):
+    def velocity(self, component = 'r', potential = None):
+        '''
+        E x B velocity, v = b x grad(potential), as a lazy field computed from the
+        potential (self.potential by default) by blocks of time steps when it is
+        read: 'r' gives the radial velocity -d(phi)/dy, 'y' the poloidal one
+        d(phi)/dx and 'abs' the magnitude of the velocity.
+        The derivatives are spectral in y when it is periodic and the points are
+        equispaced, otherwise the ones of the polynomials of the DG cells (see
+        Derivatives.py). With other coordinates, finite differences are used.
+        '''
+        if type(potential) == type(None):
+            potential = self.potential
+        if not isinstance(potential, Lazy):
+            potential = Field(potential, transpose = False, memory = self.memory)
+
+        if self.derivative_x != None:
+            d_x = lambda phi: self.derivative_x(phi, axis = 1)
+            d_y = lambda phi: self.derivative_y(phi, axis = 2)
+        else:
+            d_x = lambda phi: gradient(phi, self.x, axis = 1)
+            d_y = lambda phi: gradient(phi, self.y, axis = 2)
+
+        if component == 'r':
+            return Derived(lambda phi: -d_y(phi), potential)
+        elif component == 'y':
+            return Derived(lambda phi: d_x(phi), potential)
+        elif component == 'abs':
+            return Derived(lambda phi: sqrt(d_x(phi) ** 2 + d_y(phi) ** 2), potential)
+        raise ValueError(f'The component {component} should be r, y or abs')
+
+    @timed()
+    def flux_profile(self, start = None, stop = None, block = None):
+        '''
+        Radial profiles of the particle flux, Gamma = <n v_r>_y, and of the density,
+        <n>_y, averaged over y for every time step from start to stop (positions in
+        the time steps, the second half of the run by default), and their average in
+        that time window. The ions and the potential are read once, by blocks of
+        time steps, so only a block of the fields is kept in memory. In parallel
+        every rank does its part of the window.
+        Gives a dictionary with Gamma and n, (x), Gamma_t and n_t, (time, x), and
+        the time of the window.
+        '''
+        fields = [field if isinstance(field, Lazy) else Field(field, transpose = False, memory = self.memory)
+                  for field in [self.ions, self.v_r]]
+        ions, v_r = fields
+        start = len(ions) // 2 if start == None else start
+        stop  = len(ions)      if stop  == None else stop
+        if block == None:
+            block = min(field.block for field in fields)
+
+        local = self.local_range(stop - start)
+        Gamma_t, n_t = [empty((0, self.Nx))], [empty((0, self.Nx))]
+        for t0 in range(start + local.start, start + local.stop, block):
+            t1 = min(t0 + block, start + local.stop)
+            n  = ions.frames(t0, t1)
+            Gamma_t.append(self.integrate(n * v_r.frames(t0, t1), dim_integral = 1, axis = -1, typ = 'y') / self.ly)
+            n_t.append(self.integrate(n, dim_integral = 1, axis = -1, typ = 'y') / self.ly)
+        Gamma_t, n_t = self.gather(concatenate(Gamma_t)), self.gather(concatenate(n_t))
+
+        time   = (self.time if len(self.time) == len(ions) else self.time[::self.crop])[start:stop]
+        length = time[-1] - time[0]
+        return {'Gamma': self.integrate(Gamma_t, typ = 't', axis = 0, dim_integral = 1, indep_vars = [time]) / length,
+                'n':     self.integrate(n_t,     typ = 't', axis = 0, dim_integral = 1, indep_vars = [time]) / length,
+                'Gamma_t': Gamma_t, 'n_t': n_t, 'time': time}
+
+    def moments(self, field, second = False, block = None):
+        '''
+        Spatial moments of the field for every time step, computed by blocks of
+        time steps with the 1D weights of the integrals in x and y (no grid sized
+        copies): the integral over y of the block with the weights w_y, w_y y
+        (and w_y y^2) and then over x with w_x, w_x x (and w_x x^2).
+        Gives a dictionary with the zeroth moment M0 (the integral of the field),
+        the center X_CM and Y_CM and, with second, the spread sigma_x and sigma_y.
+        '''
+        orders = 3 if second else 2
+        w_x    = array([self.weights('x') * self.x ** i for i in range(orders)]).T
+        w_y    = array([self.weights('y') * self.y ** i for i in range(orders)]).T
+
+        def contract(values):
+            ## (time, x, y) -> (time, order y, order x)
+            return tensordot(tensordot(values, w_y, axes = ([-1], [0])), w_x, axes = ([1], [0]))
+
+        if isinstance(field, Lazy):
+            local  = self.local_range(len(field))
+            Local  = field[local.start:local.stop]
+            M      = self.gather(concatenate([contract(values) for _, _, values in Local.blocks(block)] or
+                                             [contract(Local.frames(0, 0))]))
+        else:
+            nt, nx, ny = shape(field)
+            if block == None:
+                block = max(1, int(self.memory // (4 * 8 * nx * ny)))
+            M = concatenate([contract(asarray(field[t0:t0 + block])) for t0 in range(0, nt, block)])
+
+        moments = {'M0': M[:, 0, 0], 'X_CM': M[:, 0, 1] / M[:, 0, 0], 'Y_CM': M[:, 1, 0] / M[:, 0, 0]}
+        if second:
+            moments['sigma_x'] = sqrt(absolute(M[:, 0, 2] / M[:, 0, 0] - moments['X_CM'] ** 2))
+            moments['sigma_y'] = sqrt(absolute(M[:, 2, 0] / M[:, 0, 0] - moments['Y_CM'] ** 2))
+        return moments
+
+    def field(self, variable, crop = 1):
+        '''
+        Lazy access to a variable of the netCDF file, read by blocks of time steps
+        and transposed to (time, x, y). See Fields.py
+        '''
+        return Field(self.Data[variable], crop, memory = self.memory, dtype = self.dtype)
+
+    def named(self, name):
+        '''
+        The field of the analysis called name (as the ions or v_r), or if there is
+        none the variable of the netCDF file, lazy
+        '''
+        return getattr(self, name) if isinstance(getattr(self, name, None), (Lazy, ndarray)) else self.field(name)
+
+    def load(self, variable, crop = 1, offset = 0, sign = 1):
+        '''
+        Read a variable of the netCDF file as (time, x, y). The array read from the
+        file is the only copy: the sign and offset are applied in place and the
+        result is a transposed view of it. With a dtype different from the one of
+        the file, it is read by blocks of time steps (of about memory bytes) into
+        the final array, so the full field is never held in both types.
+        '''
+        source = self.Data[variable]
+        stored = asarray(source[:0]).dtype
+        dtype  = asarray(source[:0], self.dtype).dtype
+        if dtype == stored:
+            values = asarray(source[::crop])
+        else:
+            times  = range(0, source.shape[0], crop)
+            values = empty((len(times),) + tuple(source.shape[1:]), dtype)
+            block  = max(1, int(self.memory // (int(prod(source.shape[1:])) * stored.itemsize)))
+            for t0 in range(0, len(times), block):
+                t1 = min(t0 + block, len(times))
+                values[t0:t1] = source[times[t0]:times[t1 - 1] + 1:crop]
+        count(values.size * stored.itemsize)
+
+        if sign != 1:
+            multiply(values, sign, out = values)
+        if offset != 0:
+            add(values, offset, out = values, casting = 'unsafe')
+        return values.transpose((0, 2, 1))
+
+    def integrate(self, variable, dim_integral = 2, axis = -1, typ = 't', indep_vars = None, crop = 1, block = None):
         '''
         Function to integrate a variable over the grid, this variable could be
         a vector or a matrix, or over time (would be better to average over time)
@@ -110,15 +417,35 @@ class Analyse ():
         in case we want to integrate in 2 dimensions.
         It is important to notice that the indep_vars variable is only for when
         we want to integrate a tensor with non conventional dimensions.
+        Lazy fields, and the variables given by their name, are integrated block
+        by block (of block time steps, by default given by the memory budget)
+        as long as the time is not one of the integrated dimensions.
         '''
 
         if type(variable) == str:
-            Integral = copy(self.Data[variable][::crop].transpose((0, 2, 1)))
+            variable = self.field(variable)
+
+        if isinstance(variable, Lazy):
+            Integral = variable[::crop]
         else:
             Integral = copy(variable[::crop])
 
         dim_var = ndim(Integral)
 
+        if isinstance(Integral, Lazy):
+            if dim_var == 3 and ((dim_integral == 1 and axis % 3 != 0) or (dim_integral == 2 and axis in [-1, 1])):
+                local = self.local_range(len(Integral))
+                Local = Integral[local.start:local.stop]
+                return self.gather(concatenate([self.integrate(values, dim_integral, axis, typ, indep_vars)
+                                                for _, _, values in Local.blocks(block)] or
+                                               [self.integrate(Local.frames(0, 0), dim_integral, axis, typ, indep_vars)]))
+            Integral = asarray(Integral)
+
+        if type(indep_vars) == type(None) and self.quadrature != None:
+            DG_Integral = self.dg_integrate(Integral, dim_integral, axis, typ)
+            if type(DG_Integral) != type(None):
+                return DG_Integral
+
         if type(indep_vars) != type(None):
             pass
         elif dim_var == 3:
@@ -140,6 +467,124 @@ class Analyse ():
 
         return Integral
 
+    @timed()
+    def reduce(self, fields, block = None):
+        '''
+        Statistics of several fields in a single pass over the file. fields is a
+        dictionary of lazy fields (or names of variables of the file) with the same
+        time steps. They are read by blocks of time steps, and for each one it gives
+        a dictionary with the global minimum, maximum and amplitude (max |value|) and
+        the spatial integral of the field and of its square for every time step.
+        Fields derived from others, as v_r from the potential, use the blocks already
+        read if the memory budget allows it.
+        In parallel every rank reduces its part of the time steps.
+        '''
+        fields = {name: self.field(field) if type(field) == str else field for name, field in fields.items()}
+        local  = self.local_range(len(list(fields.values())[0]))
+        if block == None:
+            block = min(field.block for field in fields.values() if isinstance(field, Lazy))
+
+        results = {name: {'min': inf, 'max': -inf, 'integral': empty(len(local)), 'integral_sqr': empty(len(local))} for name in fields}
+        for t0 in range(local.start, local.stop, block):
+            t1 = min(t0 + block, local.stop)
+            for name, field in fields.items():
+                values = field.frames(t0, t1) if isinstance(field, Lazy) else asarray(field[t0:t1])
+                result = results[name]
+                result['min'] = min(result['min'], values.min())
+                result['max'] = max(result['max'], values.max())
+                result['integral'][t0 - local.start:t1 - local.start]     = self.integrate(values)
+                result['integral_sqr'][t0 - local.start:t1 - local.start] = self.integrate(values ** 2)
+
+        for result in results.values():
+            if self.comm != None:
+                result['min'] = min(self.comm.allgather(result['min']))
+                result['max'] = max(self.comm.allgather(result['max']))
+                result['integral']     = self.gather(result['integral'])
+                result['integral_sqr'] = self.gather(result['integral_sqr'])
+            result['amp'] = max(absolute(result['min']), absolute(result['max']))
+
+        return results
+
+    @timed()
+    def fluctuations(self, fields, bins = 100, ranges = {}, perturbation = {}, block = None, accumulators = False):
+        '''
+        Radial profiles of the mean, std, rms, skewness and kurtosis of the
+        fluctuations of several fields, and their pdf at every x, in a single pass
+        over the file: every block of time steps is added to an Accumulator of
+        Statistics.py, so only (x, bins) values are kept per field.
+        fields is a dictionary (or a list of names) of lazy fields, arrays (time, x, y)
+        or names of the fields of the analysis (as v_r) or of the variables of the file.
+        The fluctuations are the ones of perturbation with the keyword arguments
+        perturbation (averg_var, intervals, profile, window), whose trend needs its own
+        pass keeping only (time, x), or the fields themselves if it is None.
+        The bins of every field are bins in ranges[name], by default the range of the
+        first block of the file (the same in all the ranks) widened by its width on
+        each side.
+        In parallel every rank accumulates its time steps and they are merged.
+        Gives {name: Accumulator.result()}, or the Accumulators themselves with
+        accumulators, to merge them with the ones of other files (Statistics.merged).
+        '''
+        fields = dict(fields) if type(fields) == dict else {name: name for name in fields}
+        for name, field in fields.items():
+            if type(field) == str:
+                field = self.named(field)
+            fields[name] = field if perturbation == None else self.perturbation(field, **perturbation)
+
+        local   = self.local_range(len(list(fields.values())[0]))
+        weights = self.weights('y')
+        if block == None:
+            block = min([field.block for field in fields.values() if isinstance(field, Lazy)] or
+                        [max(1, int(self.memory // (8 * 8 * len(self.x) * len(self.y))))])
+
+        def frames(field, t0, t1):
+            return field.frames(t0, t1) if isinstance(field, Lazy) else asarray(field[t0:t1])
+
+        results = {name: Accumulator(len(self.x), bins, ranges.get(name)) for name in fields}
+        for name, field in fields.items():
+            if results[name].edges is None:
+                first = frames(field, 0, min(block, len(field)))
+                results[name].widened(first.min(), first.max())
+
+        for t0 in range(local.start, local.stop, block):
+            t1 = min(t0 + block, local.stop)
+            for name, field in fields.items():
+                results[name].add(frames(field, t0, t1), weights)
+
+        if self.comm != None:
+            results = {name: merged(self.comm.allgather(result)) for name, result in results.items()}
+        return results if accumulators else {name: result.result() for name, result in results.items()}
+
+    def dg_integrate(self, variable, dim_integral = 2, axis = -1, typ = 't'):
+        '''
+        The spatial integrals of integrate done with the DG quadrature, which
+        is exact for the output grid and only needs one contraction with the
+        weights. It gives None when the time is integrated or the dimensions
+        do not match the grid, so integrate can use simps instead.
+        '''
+        dim_var = ndim(variable)
+        if dim_var == 1:
+            axes, axis = (['y'] if typ == 'y' else ['x'] if typ == 'x' else []), 0
+        elif dim_integral == 2 and (dim_var == 2 or axis == -1):
+            axes = ['x', 'y']
+        elif dim_integral == 1 and axis in [-1, dim_var - 1]:
+            axes = ['y']
+        elif dim_integral == 1 and axis in [-2, dim_var - 2]:
+            axes = ['x']
+        else:
+            return None
+
+        quad = self.quadrature
+        if axes == ['x', 'y'] and shape(variable)[-2:] == (len(quad.x), len(quad.y)):
+            Integral = quad.integral(variable)
+        elif axes == ['y'] and shape(variable)[axis] == len(quad.y):
+            Integral = quad.y_integral(variable, axis)
+        elif axes == ['x'] and shape(variable)[axis] == len(quad.x):
+            Integral = quad.x_integral(variable, axis)
+        else:
+            return None
+
+        return Integral[()]
+
     def pcolormesh_variable(self, variable_name, time_step, set_color_bar = False, save = None, **kwargs):
         '''
         Easy function to plot 2D variables such ions or vorticity
@@ -182,82 +627,138 @@ class Analyse ():
         show();
 
 
-    def c_corr_dt (self, f, g, time_units = 1):
+    def weights(self, typ = 'y'):
+        '''
+        The weights of integrate along x or y, so the integral of a field is the
+        sum of the field times the weights. If there is no DG quadrature, they are
+        the weights simps uses for the grid.
+        '''
+        if self.quadrature != None:
+            return self.quadrature.wy if typ == 'y' else self.quadrature.wx
+        coordinate = self.y if typ == 'y' else self.x
+        return simps(identity(len(coordinate)), coordinate, axis = -1)
+
+    @timed()
+    def c_corr_dt (self, f, g, time_units = 1, method = 'fft', block = None, lags = False):
         '''
         Cross-correlation time-delay. It is inspired in the discrete correlation
         But as we only need to look at a correlation for a tiny time shift, time_units,
         it does it with for loops. It is important to take into account that the lack
         of an infinite amount of values would make values decrease as they approach
         the borders. For that reason, the function always take the same amount of values.
+        With method = 'fft' (default) the same values are obtained from the FFT of the
+        signals, block x positions at a time, so long time delays are cheap. If
+        time_units is None, all the delays allowed by the signal length are used.
+        With lags = True the time delays are also returned.
         '''
 
         assert array_equal(shape(f), shape(g)), 'The dimensions of f and g should be equal'
 
+        nt = len(f)
         ## + 1 because we wanna do [-time_units, time_units]
-        steps  = int(time_units / self.dt) + 1
-        corr   = empty((2 * steps + 1, self.Nx, self.Ny))
-        nt     = len(f)
-        g_conj = conjugate(g)
+        if time_units == None:
+            steps = (nt - 1) // 2
+        else:
+            steps = int(time_units / self.dt) + 1
+        if nt - 2 * steps < 1:
+            raise ValueError(f'The time delay is too long for the {nt} time steps of the signals')
 
-        corr  = empty((2 * steps + 1, self.Nx, self.Ny))
-        for i in range(-steps, steps + 1):
-            corr[steps + i,:,:] = average((f * roll(g_conj,i,axis=0))[steps:-steps],axis=0)
+        if method == 'fft':
+            corr = self.c_corr_dt_fft(f, g, steps, block)
 
-        corr = self.integrate(corr, 1, axis = -1) / self.ly
+        else:
+            g_conj = conjugate(g)
 
-        return corr
+            corr  = empty((2 * steps + 1, self.Nx, self.Ny))
+            for i in range(-steps, steps + 1):
+                corr[steps + i,:,:] = average((f * roll(g_conj,i,axis=0))[steps:-steps],axis=0)
 
+            corr = self.integrate(corr, 1, axis = -1) / self.ly
 
+        if lags:
+            return corr, arange(-steps, steps + 1) * self.dt
+        return corr
 
-    def c_corr_sp (self, f, g, x0=None, y0=None, integrate = False):
+    def c_corr_dt_fft (self, f, g, steps, block = None):
+        '''
+        The time-delay cross-correlation of c_corr_dt with FFTs. For a delay i,
+        corr_i = <f(t) g*(t - i)> averaged over t in [steps, nt - steps), which is
+        the inverse transform of F G* when f is set to 0 outside that window.
+        The signal is only nt long, as t - i never goes out of [0, nt) there is
+        no need to pad it. The integral over y is done on the spectra, and the x
+        positions are processed in groups of block, so the memory is bounded.
+        '''
+        nt, nx, ny = shape(f)
+        n_fft = next_fast_len(nt)
+        w_y   = self.weights('y') / self.ly
+        real  = not (iscomplexobj(f[:1]) or iscomplexobj(g[:1]))
+        transform, inverse = (rfft, irfft) if real else (fft, ifft)
+        if block == None:
+            ## The signals and their spectra, around 8 arrays of nt * ny values per x
+            block = max(1, int(self.memory // (8 * 16 * n_fft * ny)))
+
+        corr = empty((2 * steps + 1, nx), float if real else complex)
+        for x0 in range(0, nx, block):
+            x1       = min(x0 + block, nx)
+            f_window = zeros((nt, x1 - x0, ny), float if real else complex)
+            f_window[steps:nt - steps] = f[steps:nt - steps, x0:x1]
+
+            F = transform(f_window, n_fft, axis = 0)
+            G = transform(asarray(g[:, x0:x1]), n_fft, axis = 0)
+            spectrum = tensordot(F * conjugate(G), w_y, axes = ([-1], [0]))
+
+            corr[:, x0:x1] = inverse(spectrum, n_fft, axis = 0)[arange(-steps, steps + 1) % n_fft]
+
+        return corr / (nt - 2 * steps)
+
+    @timed()
+    def c_corr_sp (self, f, g, x0=None, y0=None, integrate = False, block = None):
         '''
         Spatial cross-correlation, x and y should not be integrated. In this case,
         we avoid using the numpy and scipy functions for correlation, as they padd the
         signal with 0s, but we have a periodic signal.
+        The shifts of the periodic signal make it a circular cross-correlation, so it
+        is done with FFTs along the other direction, at once for all the positions
+        in x0 (or y0) and for block time steps at a time. The time average is done on
+        the spectra. With integrate, the result is integrated over the positions given.
         '''
 
         assert array_equal(shape(f), shape(g)), 'The dimensions of f and g should be equal'
 
-
         if type(x0) != type(None) and type(y0) == type(None):
-            z, axis        = x0, 0
-            f_cp, g_cp     = copy(f[:, z, :]), conjugate(g[:, z, :])
-            transpose_back = False
+            z, axis = atleast_1d(x0), 0
+            select  = lambda h, t0, t1: asarray(h[t0:t1, z])
 
         elif type(x0) == type(None) and type(y0) != type(None):
-            z, axis        = y0, 1
-            f_cp, g_cp     = transpose(f, (0,2,1))[:,z,:], conjugate(transpose(g, (0,2,1))[:,z,:])
-            transpose_back = True
+            z, axis = atleast_1d(y0), 1
+            select  = lambda h, t0, t1: moveaxis(asarray(h[t0:t1, :, z]), 1, -1)
 
         else:
             raise TypeError('One of the variables should be None, the other and int optimizer an array of ints')
 
-        if type(z) == list or type(z) == ndarray:
-            nt, mz, ny = shape(f_cp)
-        else:
-            mz = 1
-            nt, ny = shape(f_cp)
-
-
-        steps = int(ny / 2)
-        fcg = empty((nt, mz, 2 * steps + 1)).squeeze()
-
-        for i in range(-steps, steps + 1):
-            fcg[:,..., steps + i] = self.integrate((f_cp * roll(g_cp,i,axis=-1))
-                                                   ,1,axis=-1)
+        w     = self.weights(['y', 'x'][axis])
+        n, nt = len(w), len(f)
+        steps = int(n / 2)
+        real  = not (iscomplexobj(f[:1]) or iscomplexobj(g[:1]))
+        transform, inverse = (rfft, irfft) if real else (fft, ifft)
+        if block == None:
+            block = max(1, int(self.memory // (8 * 16 * len(z) * n)))
 
-        fcg /= [self.lx, self.ly][axis - 1]
+        spectrum = 0
+        for t0 in range(0, nt, block):
+            F = transform(w * select(f, t0, t0 + block), axis = -1)
+            G = transform(select(g, t0, t0 + block), axis = -1)
+            spectrum = spectrum + sum(F * conjugate(G), axis = 0)
 
-        fcg = average(fcg, axis = 0)
-
-        if transpose_back:
-            fcg = transpose(fcg, (0, 2, 1))
+        fcg  = inverse(spectrum, n, axis = -1)[:, arange(-steps, steps + 1) % n]
+        fcg /= nt * [self.lx, self.ly][axis - 1]
 
         if integrate:
-            fcg = self.integrate(fcg, axis = axis) / [self.lx, self.ly][axis]
+            fcg = tensordot(self.weights(['x', 'y'][axis])[z], fcg, axes = ([0], [0])) / [self.lx, self.ly][axis]
 
         return squeeze(fcg)
 
+    @timed()
     def cpsd(self, f, g, fs = None, x0=None, y0=None, Norm = False, **kwargs):
         '''
         Function to calculate the Cross - power Spectral density of 2 signals.
@@ -303,6 +804,161 @@ class Analyse ():
 
         return Amp, Ang, f
 
+    @timed()
+    def cpsd_profile(self, fields, pairs = None, fs = None, Norm = False, nperseg = 256, noverlap = None, block = None):
+        '''
+        The Cross - power Spectral density of cpsd for every radial position at once.
+        fields is a dictionary of (nt, Nx, Ny) fields, e.g. {'ions': ..., 'potential': ..., 'v_r': ...},
+        and pairs the list of (f, g) names to correlate, by default the first field
+        with each of the others. The Welch segments of each field are transformed only
+        once (for block x positions at a time) and used for all its pairs. The segments,
+        window ('hamming') and scaling are the ones of scipy csd, used by cpsd.
+        It gives a dictionary with the (Amp, Ang) profiles, of shape (frequency, Nx),
+        for every pair and the frequencies.
+        '''
+
+        names = list(fields.keys())
+        if type(pairs) == type(None):
+            pairs = [(names[0], name) for name in names[1:]]
+        used = [name for name in names if any(name in pair for pair in pairs)]
+
+        nt, nx, ny = shape(fields[used[0]])
+        assert all(array_equal(shape(fields[name]), (nt, nx, ny)) for name in used), 'The dimensions of the fields should be equal'
+
+        if fs == None:
+            fs = 1 / self.dt
+        nperseg  = min(nperseg, nt)
+        noverlap = nperseg // 2 if noverlap == None else noverlap
+        step     = nperseg - noverlap
+        window   = get_window('hamming', nperseg)
+        scale    = 1 / (fs * (window * window).sum())
+        real     = not any(iscomplexobj(fields[name][:1]) for name in used)
+        if real:
+            transform, freq = rfft, rfftfreq(nperseg, 1 / fs)
+        else:
+            transform, freq = fft,  fftfreq(nperseg, 1 / fs)
+        if block == None:
+            ## The field, its segments and their spectra, around 6 arrays of nt * Ny values per x and field
+            block = max(1, int(self.memory // (6 * 8 * len(used) * nt * ny)))
+
+        w_y      = self.weights('y') / self.ly
+        profiles = {pair: (empty((len(freq), nx)), empty((len(freq), nx))) for pair in pairs}
+        for x0 in range(0, nx, block):
+            x1      = min(x0 + block, nx)
+            spectra = {}
+            for name in used:
+                segments = sliding_window_view(asarray(fields[name][:, x0:x1]), nperseg, axis = 0)[::step]
+                segments = segments - segments.mean(axis = -1, keepdims = True)
+                spectra[name] = transform(segments * window, axis = -1)
+
+            for pair in pairs:
+                ## Average of the segments, with the same one sided scaling as csd
+                PFG = (conjugate(spectra[pair[0]]) * spectra[pair[1]]).mean(axis = 0) * scale
+                if real:
+                    PFG[..., 1:nperseg - nperseg // 2] *= 2
+
+                if Norm:
+                    Ampli = absolute(PFG)
+                    Amp   = tensordot(Ampli, w_y, axes = ([1], [0]))
+                    Ang   = tensordot(angle(PFG) * Ampli, w_y, axes = ([1], [0])) / (Amp * pi)
+                else:
+                    PFG   = tensordot(PFG, w_y, axes = ([1], [0]))
+                    Amp   = absolute(PFG)
+                    Ang   = angle(PFG)
+
+                profiles[pair][0][:, x0:x1] = Amp.transpose()
+                profiles[pair][1][:, x0:x1] = Ang.transpose()
+
+        return profiles, freq
+
+    @timed()
+    def spectrum(self, fields, pairs = None, fs = None, nperseg = 256, noverlap = None, window = 'hamming', block = None):
+        '''
+        Wavenumber - frequency spectra S(x, k_y, omega) of the fields, and the
+        cross spectra between them, for all the radial positions at once.
+        fields is a dictionary (or a list of names) as in fluctuations, and pairs the
+        list of (f, g) names of the cross spectra <conj(f) g>, by default the first
+        field with each of the others. Every time step is transformed in y, that
+        should be periodic (rfft if the points are equispaced, n_out = 1, and otherwise
+        the Fourier integral with the DG weights), and the Welch segments of the
+        result in time, with the window and detrending of csd. The segments are read
+        block segments at a time (by default as many as fit in the memory budget) and
+        their spectra are added as they come, so the memory does not grow with the
+        number of time steps, only with Nx * (Ny / 2 + 1) * nperseg per field and pair.
+        In parallel the segments are split between the ranks.
+        The k_y > 0 are one sided, so the sum of S over k_y and the frequencies times
+        the frequency step is the variance of the field (over y and t) at every x,
+        and the frequencies are signed: a wave exp(i (k_y y - omega t)) is at positive
+        k_y and omega, its phase velocity in y is omega / k_y.
+        Gives a dictionary with S {name: (Nx, k_y, frequency)}, cross {pair: the same,
+        complex}, k_y, frequency (of fs = 1 / dt by default), omega (2 pi frequency)
+        and the number of segments.
+        '''
+        fields = dict(fields) if type(fields) == dict else {name: name for name in fields}
+        fields = {name: self.named(field) if type(field) == str else field for name, field in fields.items()}
+        names  = list(fields)
+        if type(pairs) == type(None):
+            pairs = [(names[0], name) for name in names[1:]]
+
+        nt, nx, ny = shape(fields[names[0]])
+        if fs == None:
+            fs = 1 / self.dt
+        nperseg  = min(nperseg, nt)
+        noverlap = nperseg // 2 if noverlap == None else noverlap
+        step     = nperseg - noverlap
+        taper    = get_window(window, nperseg).reshape(-1, 1, 1)
+        scale    = 1 / (fs * (taper * taper).sum())
+
+        ## Transform in y, normalised as an average over y and one sided
+        k_y   = 2 * pi * rfftfreq(ny, self.ly / ny)
+        sides = where((arange(len(k_y)) > 0) & (arange(len(k_y)) < ny - ny // 2), 2, 1)
+        if allclose(diff(self.y), self.y[1] - self.y[0]):
+            to_k_y = lambda values: rfft(values, axis = -1) / ny
+        else:
+            basis  = (self.weights('y') / self.ly).reshape(-1, 1) * exp(-1j * outer(self.y, k_y))
+            to_k_y = lambda values: tensordot(values, basis, axes = ([-1], [0]))
+
+        ## The time transform is kernel exp(-i 2 pi f t), so the frequencies are reversed to
+        ## give the waves exp(-i omega t) positive omega, and sorted
+        frequency = -fftfreq(nperseg, 1 / fs)
+        order     = argsort(frequency)
+
+        n_seg = (nt - nperseg) // step + 1
+        local = self.local_range(n_seg)
+        if block == None:
+            ## The y transform of the frames of the segments and their spectra
+            block = max(1, int(self.memory // (3 * 16 * len(fields) * nperseg * nx * len(k_y))))
+
+        def frames(field, t0, t1):
+            return field.frames(t0, t1) if isinstance(field, Lazy) else asarray(field[t0:t1])
+
+        powers = {name: zeros((nperseg, nx, len(k_y))) for name in names}
+        cross  = {pair: zeros((nperseg, nx, len(k_y)), complex) for pair in pairs}
+        for s0 in range(local.start, local.stop, block):
+            s1      = min(s0 + block, local.stop)
+            spectra = {}
+            for name, field in fields.items():
+                values   = to_k_y(frames(field, s0 * step, (s1 - 1) * step + nperseg))
+                segments = sliding_window_view(values, nperseg, axis = 0)[::step]
+                segments = moveaxis(segments, -1, 1)
+                segments = segments - segments.mean(axis = 1, keepdims = True)
+                spectra[name] = fft(segments * taper, axis = 1)
+
+            for name in names:
+                powers[name] += (absolute(spectra[name]) ** 2).sum(axis = 0)
+            for pair in pairs:
+                cross[pair]  += (conjugate(spectra[pair[0]]) * spectra[pair[1]]).sum(axis = 0)
+
+        def spectrum_of(total):
+            if self.comm != None:
+                total = self.comm.allreduce(total)
+            ## (frequency, x, k_y) -> (x, k_y, frequency)
+            return moveaxis(total[order] * sides * scale / max(n_seg, 1), 0, -1)
+
+        return {'S': {name: spectrum_of(total) for name, total in powers.items()},
+                'cross': {pair: spectrum_of(total) for pair, total in cross.items()},
+                'k_y': k_y, 'frequency': frequency[order], 'omega': 2 * pi * frequency[order], 'segments': n_seg}
+
     def save_matlab(self, variables_dic, name = None, model = None):
         '''
         A function that allow us to save the values we want into a matlab file.
@@ -318,31 +974,64 @@ class Analyse ():
 
         savemat(name, mdict = variables_dic)
 
-    def perturbation(self, variable, averg_var = None, intervals = None):
+    @timed()
+    def perturbation(self, variable, averg_var = None, intervals = None, profile = False, window = None):
         '''
         Take out the trend of a signal to get only the perturbation.
         We shall accept that the variables obtained from simulations can be
         separated into: n = ñ + <n>, where <n> is the average and ñ the perturbation.
         It is important to notice that we are only interested in analysing the
         perturbation ñ.
+        The average is taken from averg_var, by default the average over y of the
+        variable, (time, x). It is the average over all of it, or over every interval
+        between the consecutive time steps of intervals (outside them nothing is
+        subtracted), or the moving average of window time steps centered in every time
+        step. With profile, the average is done for every x (a radial profile)
+        instead of a single value. All of them are obtained from the cumulative sum
+        of averg_var over the time, without loops.
+        Lazy fields (and variables given by their name) give a lazy perturbation,
+        the trend is subtracted block by block when it is read.
         '''
 
         if type(variable) == str:
-            perturb = copy(self.Data[variable][:])
+            perturb = self.field(variable)
+        elif isinstance(variable, Lazy):
+            perturb = variable
         else:
             perturb = copy(variable)
 
         if type(averg_var) == type(None):
             averg_var = self.integrate(perturb, dim_integral = 1, typ = 'y') / self.ly
+        averg_var = asarray(averg_var)
+        if not profile and ndim(averg_var) > 1:
+            averg_var = average(averg_var.reshape(len(averg_var), -1), axis = -1)
 
-        if type(intervals) == type(None):
-            return perturb - average(averg_var)
+        nt     = len(averg_var)
+        cumul  = concatenate([zeros((1,) + shape(averg_var)[1:]), cumsum(averg_var, axis = 0)])
+        if type(window) != type(None):
+            half   = int(window) // 2
+            lower  = clip(arange(nt) - half,     0, nt)
+            upper  = clip(arange(nt) + half + 1, 0, nt)
+            trend  = (cumul[upper] - cumul[lower]) / (upper - lower).reshape((-1,) + (1,) * (ndim(averg_var) - 1))
 
-        else:
-            for i in range(len(intervals)):
-                perturb[intervals[i]:intervals[i + 1]] -= average(averg_var[intervals[i]:intervals[i + 1]])
+        elif type(intervals) == type(None):
+            trend  = (cumul[-1] / nt)[None]
 
-            return perturb
+        else:
+            bounds = asarray(intervals, int)
+            length = (bounds[1:] - bounds[:-1]).reshape((-1,) + (1,) * (ndim(averg_var) - 1))
+            means  = (cumul[bounds[1:]] - cumul[bounds[:-1]]) / where(length > 0, length, 1)
+            ## The interval of every time step, the ones outside all of them are not changed
+            inside = (arange(nt) >= bounds[0]) & (arange(nt) < bounds[-1])
+            trend  = means[clip(searchsorted(bounds, arange(nt), side = 'right') - 1, 0, len(means) - 1)]
+            trend *= inside.reshape((-1,) + (1,) * (ndim(averg_var) - 1))
+
+        trend = trend.reshape(shape(trend) + (1,) * (ndim(perturb) - ndim(trend)))
+        if isinstance(perturb, Lazy):
+            return perturb - (trend if len(trend) == len(perturb) else trend[0])
+
+        perturb -= trend
+        return perturb
 
 class units():
     '''
@@ -0,0 +1,233 @@
+'''
+Batch analysis of all the outputs of FELTOR under a directory (e.g. a parameter
+scan), every output is analysed in a process of a local pool and the results
+are collected in a table (a csv file), one row per output, and the time, bytes
+read and memory of every stage of each output in a json next to it (see Instrument.py).
+It can be used as a module, run(root, ...), or from the command line:
+    python Batch.py root_directory -d mass cm flux -j 8 -m 4 -o scan.csv
+'''
+
+from Analysis          import Analyse
+from Instrument        import recorder, stage
+from argparse          import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from csv               import DictReader, DictWriter
+from os                import walk, stat, replace, cpu_count
+from os.path           import join, abspath, exists, splitext
+from json              import dump, load
+from fnmatch           import fnmatch
+from time              import time
+from numpy             import average, absolute
+
+
+#=====================================================================================
+# Diagnostics, every one gets the Analyse object and gives a dictionary of values
+#=====================================================================================
+
+def mass_diagnostic(Analytics):
+    '''
+    Mass at the beginning and the end, and its maximum relative change
+    '''
+    Mass = Analytics.Mass
+    return {'mass_0': Mass[0], 'mass_end': Mass[-1],
+            'mass_error': max(absolute(Mass - Mass[0])) / absolute(Mass[0])}
+
+def cm_diagnostic(Analytics):
+    '''
+    Final position of the Center of Mass and its average velocity
+    '''
+    Analytics.CM()
+    Analytics.V_CM()
+    return {'X_CM_end': Analytics.X_CM[-1], 'Y_CM_end': Analytics.Y_CM[-1],
+            'V_CM_x': average(Analytics.V_CM_x), 'V_CM_y': average(Analytics.V_CM_y)}
+
+def flux_diagnostic(Analytics):
+    '''
+    Radial flux of particles averaged over y, x and the second half of the time
+    '''
+    hlf   = Analytics.nt // 2
+    Gamma = Analytics.integrate(Analytics.ions[hlf:] * Analytics.v_r[hlf:]) / (Analytics.lx * Analytics.ly)
+    return {'flux': average(Gamma)}
+
+def invariants_diagnostic(Analytics):
+    '''
+    Final invariants saved by the simulation and the largest residuals of the
+    mass and energy balance, it does not need the fields
+    '''
+    Analytics.read_invariants()
+    return {'invariant_mass_end': Analytics.invariants['mass'][-1], 'energy_end': Analytics.Energy[-1],
+            'mass_residual': max(absolute(Analytics.mass_residual)),
+            'energy_residual': max(absolute(Analytics.energy_residual))}
+
+diagnostics = {'mass': mass_diagnostic, 'cm': cm_diagnostic, 'flux': flux_diagnostic,
+               'invariants': invariants_diagnostic}
+
+## The diagnostics that do not need to read the fields
+light = ['invariants']
+
+
+#=====================================================================================
+# Engine
+#=====================================================================================
+
+def discover(root, pattern = 'output_*.nc', exclude = ['*_prbs.nc']):
+    '''
+    All the outputs under the directory root, sorted by their path
+    '''
+    found = []
+    for directory, _, names in walk(root):
+        for name in names:
+            if fnmatch(name, pattern) and not any(fnmatch(name, other) for other in exclude):
+                found.append(abspath(join(directory, name)))
+    return sorted(found)
+
+def limit_memory(limit):
+    '''
+    Limit the address space of the worker process to limit bytes, so a file
+    too large fails by itself instead of taking down the whole node
+    '''
+    if limit != None:
+        from resource import setrlimit, getrlimit, RLIMIT_AS
+        setrlimit(RLIMIT_AS, (int(limit), getrlimit(RLIMIT_AS)[1]))
+
+def analyse_file(File_name, names, memory = 2 ** 30):
+    '''
+    Run the diagnostics names over an output, giving the row of the table, with
+    the measures of its stages in profile. The errors are kept in the row, so one
+    broken output does not stop the batch.
+    '''
+    recorder.reset()
+    status = stat(File_name)
+    row    = {'file': File_name, 'mtime': status.st_mtime_ns, 'diagnostics': ' '.join(names), 'error': ''}
+    start  = time()
+    fields = any(name not in light for name in names)
+    try:
+        Analytics = Analyse(File_name, input_model = True, dimensions = True, fields = fields, get_everything = False,
+                            integrate_fields = fields, lazy = True, memory = memory)
+        row.update({'model': Analytics.model, 'nt': Analytics.nt, 't_end': Analytics.time[-1]})
+        for name in names:
+            with stage(name):
+                row.update(diagnostics[name](Analytics))
+    except Exception as error:
+        row['error'] = f'{type(error).__name__}: {error}'
+    row['seconds'] = time() - start
+    row['profile'] = recorder.report()['stages']
+    return row
+
+def read_table(table):
+    '''
+    The rows of a table written by run, by file
+    '''
+    if not exists(table):
+        return {}
+    with open(table, newline = '') as file:
+        return {row['file']: row for row in DictReader(file)}
+
+def write_table(table, rows):
+    '''
+    Write all the rows to the table, through a temporary file so it is never
+    left half written
+    '''
+    fields = ['file', 'model', 'nt', 't_end']
+    for row in rows:
+        fields += [field for field in row if field not in fields]
+    last   = ['diagnostics', 'mtime', 'seconds', 'error']
+    fields = [field for field in fields if field not in last + ['profile']] + last
+    with open(table + '.tmp', 'w', newline = '') as file:
+        writer = DictWriter(file, fields, extrasaction = 'ignore')
+        writer.writeheader()
+        writer.writerows(rows)
+    replace(table + '.tmp', table)
+
+def profile_name(table):
+    '''
+    The json with the measures of the stages of the outputs of the table
+    '''
+    return splitext(table)[0] + '_profile.json'
+
+def write_profile(table, rows):
+    '''
+    Write the measures of the stages of every output analysed, by file, keeping
+    the ones of the outputs skipped in this run
+    '''
+    profiles = {}
+    if exists(profile_name(table)):
+        with open(profile_name(table)) as file:
+            profiles = load(file)
+    profiles.update({row['file']: row['profile'] for row in rows if 'profile' in row})
+    with open(profile_name(table) + '.tmp', 'w') as file:
+        dump(profiles, file, indent = 1)
+    replace(profile_name(table) + '.tmp', profile_name(table))
+
+def pending(row, File_name, names):
+    '''
+    The diagnostics names still to run over an output, given its row of the table
+    (None if it is not there): all of them if it is not there, failed or was
+    modified since, otherwise the ones not in the row
+    '''
+    if row == None or row['error'] != '' or int(row['mtime']) != stat(File_name).st_mtime_ns:
+        return names
+    done = (row.get('diagnostics') or '').split()
+    return [name for name in names if name not in done]
+
+def run(root, names = ['mass', 'cm', 'flux'], workers = None, memory = 2 ** 30, limit = None,
+        table = None, redo = False, pattern = 'output_*.nc', verbose = True):
+    '''
+    Analyse all the outputs under root with workers processes (by default one per
+    core), each one reading at most memory bytes of every field at once and with
+    its address space limited to limit bytes. The table (root/analysis.csv by
+    default) is written after every output, and the profile of their stages (in
+    root/analysis_profile.json) at the end. The outputs already in the table without
+    errors and not modified since are skipped, unless redo, or only the diagnostics
+    not in their row are run and added to it.
+    Gives the rows of the table.
+    '''
+    table = join(root, 'analysis.csv') if table == None else table
+    done  = {} if redo else read_table(table)
+    files = discover(root, pattern)
+    rows  = {name: row for name, row in done.items() if name in files}
+    todo  = {name: pending(rows.get(name), name, names) for name in files}
+    todo  = {name: missing for name, missing in todo.items() if len(missing) > 0}
+
+    if verbose:
+        print(f'{len(files)} outputs found, {len(files) - len(todo)} already analysed')
+
+    workers = min(workers or cpu_count(), max(1, len(todo)))
+    with ProcessPoolExecutor(workers, initializer = limit_memory, initargs = (limit,)) as pool:
+        futures = {pool.submit(analyse_file, name, missing, memory): name for name, missing in todo.items()}
+        for future in as_completed(futures):
+            try:
+                row = future.result()
+            except Exception as error:   ## The worker died, e.g. killed by the memory limit
+                row = {'file': futures[future], 'mtime': stat(futures[future]).st_mtime_ns,
+                       'error': f'{type(error).__name__}: {error}'}
+            ## The columns of the diagnostics run before are kept if only new ones were run
+            if row['error'] == '' and todo[row['file']] != names:
+                old = rows[row['file']]
+                row = {**old, **row, 'diagnostics': ' '.join(old['diagnostics'].split() + row['diagnostics'].split()),
+                       'seconds': float(old['seconds']) + row['seconds']}
+            rows[row['file']] = row
+            write_table(table, [rows[name] for name in sorted(rows)])
+            if verbose:
+                print(f"{row['file']} {'done' if row['error'] == '' else row['error']}")
+
+    if len(todo) > 0:
+        write_profile(table, [rows[name] for name in todo])
+    return [rows[name] for name in sorted(rows)]
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description = 'Analyse all the FELTOR outputs under a directory')
+    parser.add_argument('root', help = 'directory where the outputs are searched')
+    parser.add_argument('-d', '--diagnostics', nargs = '+', default = ['mass', 'cm', 'flux'], choices = list(diagnostics))
+    parser.add_argument('-j', '--workers', type = int, default = None, help = 'number of processes, one per core by default')
+    parser.add_argument('-m', '--memory', type = float, default = 1, help = 'GB of every field read at once')
+    parser.add_argument('-l', '--limit', type = float, default = None, help = 'GB of address space of every process')
+    parser.add_argument('-o', '--table', default = None, help = 'csv file of the results, root/analysis.csv by default')
+    parser.add_argument('-p', '--pattern', default = 'output_*.nc')
+    parser.add_argument('--redo', action = 'store_true', help = 'analyse again the outputs already in the table')
+    arguments = parser.parse_args()
+
+    run(arguments.root, arguments.diagnostics, arguments.workers, int(arguments.memory * 2 ** 30),
+        None if arguments.limit == None else int(arguments.limit * 2 ** 30),
+        arguments.table, arguments.redo, arguments.pattern)
@@ -0,0 +1,178 @@
+'''
+Benchmarks of the analysis over synthetic outputs of several sizes (see Synthetic.py).
+Every case is timed (the best of some repetitions) and its peak of memory allocated
+is measured with tracemalloc, the results are saved as json and compared with a
+baseline, so the regressions are seen before they reach the runs in production.
+    python Benchmark.py -s small medium                 ## run and compare with the baseline
+    python Benchmark.py -s small medium --save-baseline ## run and keep it as the new baseline
+'''
+
+from sys               import path
+from os.path           import join, dirname, abspath, exists
+from os                import makedirs
+path.insert(1, join(dirname(abspath(__file__)), '..', 'Python_GIF'))
+
+from Analysis          import Analyse
+from Synthetic         import write
+from argparse          import ArgumentParser
+from json              import dump, load
+from time              import perf_counter
+from tracemalloc       import start, stop, get_traced_memory, reset_peak
+from tempfile          import gettempdir
+from matplotlib        import use
+use("Agg")
+from matplotlib.pyplot import subplots, close
+
+## Sizes of the synthetic outputs, as changes of the input of FELTOR
+sizes = {'small':  {'Nx_out': 16, 'Ny_out': 16, 'maxout': 50,  'itstp': 10},
+         'medium': {'Nx_out': 42, 'Ny_out': 64, 'maxout': 200, 'itstp': 10},
+         'large':  {'Nx_out': 84, 'Ny_out': 128, 'maxout': 400, 'itstp': 10}}
+default_baseline = join(dirname(abspath(__file__)), 'benchmark_baseline.json')
+
+
+#=====================================================================================
+# Cases, every one gets the name of the output and the Analyse already open
+# (eager), and it should do only the work measured
+#=====================================================================================
+
+def case_open(File_name, Analytics):
+    Analyse(File_name)
+
+def case_integrate(File_name, Analytics):
+    Analytics.integrate(Analytics.ions)
+
+def case_CM(File_name, Analytics):
+    Analytics.CM()
+    Analytics.V_CM()
+
+def case_c_corr_dt(File_name, Analytics):
+    Analytics.c_corr_dt(Analytics.ions, Analytics.potential, time_units = None)
+
+def case_c_corr_sp(File_name, Analytics):
+    Analytics.c_corr_sp(Analytics.ions, Analytics.potential, x0 = range(Analytics.Nx), integrate = True)
+
+def case_cpsd(File_name, Analytics):
+    Analytics.cpsd(Analytics.ions, Analytics.potential, x0 = Analytics.Nx // 2, nperseg = min(256, Analytics.nt))
+
+def case_Flux_plot(File_name, Analytics):
+    import GIF_modules
+    fig, ax = subplots(1, 2)
+    GIF_modules.Flux_plot(Analytics, ax, fig, model = Analytics.model)
+    close(fig)
+
+def case_animate(File_name, Analytics):
+    import GIF_modules
+    Analyzed  = GIF_modules.Analyzed(File_name, cache = False)
+    fig, ax   = subplots(2, 3, figsize = (24, 12))
+    artists   = GIF_modules.init_persistent(Analyzed, ax, fig, Analyzed.model)
+    GIF_modules.animate_persistent(Analyzed.nt // 2, Analyzed, artists)
+    fig.canvas.draw()
+    close(fig)
+
+cases = {'open': case_open, 'integrate': case_integrate, 'CM': case_CM, 'c_corr_dt': case_c_corr_dt,
+         'c_corr_sp': case_c_corr_sp, 'cpsd': case_cpsd, 'Flux_plot': case_Flux_plot, 'animate': case_animate}
+
+
+#=====================================================================================
+# Engine
+#=====================================================================================
+
+def output(size, directory = None):
+    '''
+    The synthetic output of the size, written the first time it is needed
+    '''
+    directory = join(gettempdir(), 'FELTOR_benchmark') if directory == None else directory
+    makedirs(directory, exist_ok = True)
+    File_name = join(directory, f'output_{size}.nc')
+    if not exists(File_name):
+        write(File_name, {'model': 'IC', 'modified': 0, **sizes[size]})
+    return File_name
+
+def measure(case, File_name, repeat = 3):
+    '''
+    Best time of repeat runs of the case and the peak of memory allocated by it
+    '''
+    Analytics = Analyse(File_name)
+    times = []
+    for _ in range(repeat):
+        tic = perf_counter()
+        cases[case](File_name, Analytics)
+        times.append(perf_counter() - tic)
+
+    start()
+    reset_peak()
+    base = get_traced_memory()[0]
+    cases[case](File_name, Analytics)
+    peak = get_traced_memory()[1] - base
+    stop()
+    return {'seconds': min(times), 'peak_bytes': peak}
+
+def run(names = ['small'], selected = None, repeat = 3, directory = None, verbose = True):
+    '''
+    Run the cases selected (all by default) for the sizes in names
+    Gives {size: {case: {'seconds', 'peak_bytes'}}}
+    '''
+    results = {}
+    for size in names:
+        File_name = output(size, directory)
+        results[size] = {}
+        for case in selected or list(cases):
+            results[size][case] = measure(case, File_name, repeat)
+            if verbose:
+                print(f"{size:8s} {case:10s} {results[size][case]['seconds']:10.4f} s "
+                      f"{results[size][case]['peak_bytes'] / 2 ** 20:10.2f} MB")
+    return results
+
+def compare(results, baseline, tolerance = 1.2, minimum = {'seconds': 1e-2, 'peak_bytes': 2 ** 20}):
+    '''
+    Compare the results with the baseline, giving the cases which take more
+    than tolerance times the time or the memory of the baseline (the ones below
+    minimum are only noise)
+    '''
+    regressions = []
+    for size, values in results.items():
+        for case, value in values.items():
+            if case not in baseline.get(size, {}):
+                continue
+            old = baseline[size][case]
+            for key in ['seconds', 'peak_bytes']:
+                ratio = value[key] / max(old[key], 1e-12)
+                if ratio > tolerance and value[key] > minimum[key]:
+                    regressions.append((size, case, key, ratio))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description = 'Benchmarks of the analysis with synthetic outputs')
+    parser.add_argument('-s', '--sizes', nargs = '+', default = ['small'], choices = list(sizes))
+    parser.add_argument('-c', '--cases', nargs = '+', default = None, choices = list(cases))
+    parser.add_argument('-r', '--repeat', type = int, default = 3)
+    parser.add_argument('-d', '--directory', default = None, help = 'where the synthetic outputs are kept')
+    parser.add_argument('-o', '--output', default = None, help = 'json file for the results')
+    parser.add_argument('-b', '--baseline', default = default_baseline)
+    parser.add_argument('-t', '--tolerance', type = float, default = 1.2)
+    parser.add_argument('--save-baseline', action = 'store_true', help = 'keep the results as the baseline')
+    arguments = parser.parse_args()
+
+    results = run(arguments.sizes, arguments.cases, arguments.repeat, arguments.directory)
+    if arguments.output != None:
+        with open(arguments.output, 'w') as file:
+            dump(results, file, indent = 1)
+
+    if arguments.save_baseline:
+        baseline = {}
+        if exists(arguments.baseline):
+            with open(arguments.baseline) as file:
+                baseline = load(file)
+        for size, values in results.items():
+            baseline.setdefault(size, {}).update(values)
+        with open(arguments.baseline, 'w') as file:
+            dump(baseline, file, indent = 1)
+
+    elif exists(arguments.baseline):
+        with open(arguments.baseline) as file:
+            regressions = compare(results, load(file), arguments.tolerance)
+        for size, case, key, ratio in regressions:
+            print(f'REGRESSION {size} {case} {key}: {ratio:.2f} times the baseline')
+        if len(regressions) == 0:
+            print('No regressions with respect to the baseline')
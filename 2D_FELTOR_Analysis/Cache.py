@@ -0,0 +1,102 @@
+from hashlib           import sha1
+from json              import dumps
+from os                import listdir, makedirs, remove, replace, stat, utime, getpid
+from os.path           import abspath, basename, splitext, join, exists, getsize, getmtime, expanduser
+from numpy             import load, savez, atleast_1d
+
+default_directory = join(expanduser('~'), '.cache', 'FELTOR_Analysis')
+## Changed when the way the diagnostics are computed changes, so the old ones are not used
+version = 5
+
+
+class Sidecar ():
+    '''
+    A file next to (or in a cache directory for) an output of FELTOR where the
+    diagnostics already computed are kept, so the next time they are only loaded.
+    The sidecar is identified by the path, size and modification time of the
+    output (or the list of outputs of a restarted run) and by the parameters given
+    (crop...), so if the simulation output changes, a different sidecar is used
+    and the old one is removed as stale.
+    The cache directory never takes more than max_size bytes, the sidecars used
+    the longest time ago are removed first.
+    '''
+
+    def __init__(self, File_name, directory = None, max_size = 2 ** 30, **parameters):
+        names          = File_name if type(File_name) in [list, tuple] else [File_name]
+        self.source    = [abspath(name) for name in names]
+        self.directory = default_directory if directory == None else directory
+        self.max_size  = max_size
+
+        self.size      = [stat(source).st_size     for source in self.source]
+        self.mtime     = [stat(source).st_mtime_ns for source in self.source]
+        key       = dumps([version, self.source, self.size, self.mtime, parameters], sort_keys = True)
+        self.name = join(self.directory, f'{splitext(basename(self.source[0]))[0]}_{sha1(key.encode()).hexdigest()[:16]}.npz')
+
+    def load(self):
+        '''
+        All the diagnostics saved for the output, a dictionary of arrays
+        '''
+        if not exists(self.name):
+            return {}
+        try:
+            with load(self.name) as values:
+                values = {name: values[name] for name in values.files if name not in ['source', 'size', 'mtime']}
+        except (OSError, ValueError):
+            return {}
+        ## Mark it as recently used for the eviction
+        utime(self.name)
+        return values
+
+    def save(self, values):
+        '''
+        Add the diagnostics in the dictionary values to the sidecar. It is written
+        to a temporary file first, so several processes can share the cache.
+        '''
+        makedirs(self.directory, exist_ok = True)
+        values    = {**self.load(), **values}
+        temporary = f'{self.name}.{getpid()}.tmp'
+        with open(temporary, 'wb') as file:
+            savez(file, source = self.source, size = self.size, mtime = self.mtime, **values)
+        replace(temporary, self.name)
+        self.evict()
+
+    def evict(self):
+        '''
+        Remove the sidecars whose output does not exist or changed, and the
+        least recently used ones while the directory is larger than max_size
+        '''
+        alive = []
+        for name in listdir(self.directory):
+            sidecar = join(self.directory, name)
+            if not name.endswith('.npz'):
+                continue
+            try:
+                with load(sidecar) as values:
+                    sources, sizes, mtimes = [atleast_1d(values[name]) for name in ['source', 'size', 'mtime']]
+                stale = any(not exists(str(source)) or stat(str(source)).st_size != int(size) or
+                            stat(str(source)).st_mtime_ns != int(mtime) for source, size, mtime in zip(sources, sizes, mtimes))
+            except FileNotFoundError:
+                continue
+            except (OSError, ValueError, KeyError):
+                stale = True
+            if stale:
+                _remove(sidecar)
+            else:
+                alive.append(sidecar)
+
+        alive.sort(key = getmtime)
+        total = sum(getsize(sidecar) for sidecar in alive)
+        while total > self.max_size and len(alive) > 0:
+            sidecar = alive.pop(0)
+            total  -= getsize(sidecar)
+            _remove(sidecar)
+
+
+def _remove(sidecar):
+    '''
+    Remove a sidecar, another process may have done it already
+    '''
+    try:
+        remove(sidecar)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,59 @@
+from scipy.fft         import fft, ifft, fftfreq
+from numpy             import gradient, argsort, exp, pi, einsum, moveaxis, allclose, shape, real
+from numpy.linalg      import solve
+from Quadrature        import dg_weights
+
+
+class Derivative ():
+    '''
+    Derivative along one direction of the output grid of FELTOR. If the direction
+    is periodic it is the one of the trigonometric polynomial through the values at
+    all the nodes, which converges spectrally for the smooth fields (for n_out = 1
+    it is the usual derivative with the FFT). Otherwise it is done with
+    numpy.gradient, of second order also at the edges.
+    '''
+
+    def __init__(self, n_out, N, l, periodic = False, x0 = 0):
+        self.n, self.N, self.l = n_out, N, l
+        self.periodic = periodic
+        self.x, _     = dg_weights(n_out, N, x0, x0 + l)
+        if periodic:
+            ## The nodes are the ones of the first cell shifted by every cell, so the
+            ## modes m = p + N q only mix with the same p after the FFT over the cells:
+            ## for every p the n values of the cells (p) give the n modes with a small system
+            m     = fftfreq(n_out * N, 1 / (n_out * N)).round().astype(int)
+            m     = m[argsort(m % N, kind = 'stable')].reshape(N, n_out)
+            k     = 2 * pi * m / l
+            ik    = 1j * k
+            if n_out * N % 2 == 0:
+                ik[m == -(n_out * N // 2)] = 0   ## The Nyquist mode has no derivative in a real signal
+            A     = exp(1j * k[:, None, :] * self.x[None, :n_out, None])
+            ## D[p] = A[p] diag(ik[p]) A[p]^-1, the derivative of the values of the cells (p)
+            self.D = moveaxis(solve(moveaxis(A, 1, 2), moveaxis(A * ik[:, None, :], 1, 2)), 1, 2)
+
+    @classmethod
+    def from_input(cls, input, direction = 'y', field = 'phi'):
+        '''
+        Create the derivative in the direction (x or y) from the input dictionary of the
+        simulation, with the boundary conditions of the field (phi, n or omega)
+        '''
+        bc = input.get(f'bc_{direction}_{field}', input.get(f'bc_{direction}'))
+        return cls(input['n_out'], input[f'N{direction}_out'], input[f'l{direction}'], bc == 'PER')
+
+    def matches(self, x):
+        '''
+        Check if the coordinates x are the nodes of this derivative
+        '''
+        return shape(x) == shape(self.x) and allclose(x, self.x)
+
+    def __call__(self, f, axis = -1):
+        '''
+        Derivative of f along axis
+        '''
+        if not self.periodic:
+            return gradient(f, self.x, axis = axis, edge_order = 2)
+
+        cells = moveaxis(f, axis, -1)
+        cells = cells.reshape(cells.shape[:-1] + (self.N, self.n))
+        df    = ifft(einsum('pjq,...pq->...pj', self.D, fft(cells, axis = -2)), axis = -2)
+        return moveaxis(real(df).reshape(df.shape[:-2] + (self.N * self.n,)), -1, axis)
@@ -0,0 +1,287 @@
+from collections       import OrderedDict
+from operator          import index
+from numpy             import asarray, concatenate, empty, arange, ndarray, ndim, prod
+from numpy             import add, subtract, multiply, true_divide, power, negative, absolute
+from numpy             import ones, amax, amin, errstate
+from Instrument        import count
+
+
+class Lazy ():
+    '''
+    Base class of the fields that are only read (or computed) when they are used.
+    A lazy field behaves as an array of shape (nt, Nx, Ny): it can be sliced,
+    combined with numpy functions and arrays, and it is only turned into a real
+    array when numpy asks for it. The time axis is always the first one and the
+    data is delivered in blocks of consecutive time steps.
+    '''
+
+    def __len__(self):
+        return len(self.times)
+
+    @property
+    def shape(self):
+        return (len(self.times),) + tuple(self.frame_shape)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(prod(self.shape))
+
+    @property
+    def nbytes(self):
+        return self.size * self.dtype.itemsize
+
+    def view(self, times):
+        '''
+        A new lazy field sharing the source (and its cache) with this one,
+        but only looking at the time steps given by times (a range)
+        '''
+        new       = object.__new__(type(self))
+        new.__dict__.update(self.__dict__)
+        new.times = times
+        return new
+
+    def _read(self, times):
+        '''
+        Read the time steps given by the range times, which are positions of the
+        source, not of the view. Every subclass defines _load for ascending ranges.
+        '''
+        if len(times) == 0:
+            return empty((0,) + tuple(self.frame_shape), self.dtype)
+        if times.step < 0:
+            return self._read(times[::-1])[::-1]
+        return self._load(times)
+
+    def frames(self, start, stop):
+        '''
+        The array of the time steps from start to stop (positions in the field),
+        it should be considered read only
+        '''
+        return self._read(self.times[start:stop])
+
+    def blocks(self, size = None):
+        '''
+        Iterate over the field in blocks of time steps, the blocks are given as
+        (start, stop, array) where start and stop are positions in the field.
+        The arrays given here should be considered read only.
+        '''
+        size = self.block if size == None else max(1, int(size))
+        for start in range(0, len(self), size):
+            stop = min(start + size, len(self))
+            yield start, stop, self._read(self.times[start:stop])
+
+    def __getitem__(self, key):
+        '''
+        Same slicing as a numpy array. If only the time axis is sliced the result
+        is still a lazy field, otherwise only the time blocks touched are read.
+        '''
+        if type(key) != tuple:
+            key = (key,)
+
+        rest = key[1:]
+        if len(key) == 0 or any(k is Ellipsis or k is None for k in key[:1]):
+            return self.__array__()[key]
+
+        if type(key[0]) == slice and all(type(k) == slice and k == slice(None) for k in rest):
+            return self.view(self.times[key[0]])
+
+        ## Several index arrays are broadcast together by numpy, also with the one of the time
+        if sum(type(k) in [list, ndarray] for k in key) > 1:
+            return self.__array__()[key]
+
+        time = key[0]
+        if type(time) == slice:
+            times = self.times[time]
+            return concatenate([_own(self._read(times[i:i + self.block])[(slice(None),) + rest])
+                                for i in range(0, len(times), self.block)] or
+                               [empty((0,) + tuple(self.frame_shape), self.dtype)[(slice(None),) + rest]])
+        try:
+            position = index(time)
+        except TypeError:
+            positions = arange(len(self))[asarray(time)]
+            if ndim(positions) != 1:
+                return self.__array__()[key]
+            return concatenate([self[i][None][(slice(None),) + rest] for i in positions] or
+                               [empty((0,) + tuple(self.frame_shape), self.dtype)[(slice(None),) + rest]])
+
+        if position < -len(self) or position >= len(self):
+            raise IndexError(f'index {position} is out of bounds for axis 0 with size {len(self)}')
+        position %= len(self)
+        ## Indexed with the position in the block, so an integer with index arrays is treated as numpy does
+        return _own(self._read(self.times[position:position + 1])[(0,) + rest])
+
+    def __array__(self, dtype = None, copy = None):
+        '''
+        Materialize the full field, only used when there is no other option
+        '''
+        out = empty(self.shape, self.dtype if dtype == None else dtype)
+        for start, stop, block in self.blocks():
+            out[start:stop] = block
+        return out
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        '''
+        Element-wise numpy functions give another lazy field, the rest of
+        operations (reductions, accumulations...) are done on the real array
+        '''
+        if method != '__call__' or 'out' in kwargs or ufunc.nout != 1:
+            inputs = [asarray(i) if isinstance(i, Lazy) else i for i in inputs]
+            return getattr(ufunc, method)(*inputs, **kwargs)
+        return Derived(lambda *blocks: ufunc(*blocks, **kwargs), *inputs)
+
+    def transpose(self, *axes):
+        '''
+        Transpose the field, the time axis has to stay in the first position
+        to keep the field lazy.
+        '''
+        if len(axes) == 1 and type(axes[0]) in [tuple, list]:
+            axes = tuple(axes[0])
+        if len(axes) == 0:
+            return self.__array__().transpose()
+        if axes[0] != 0:
+            return self.__array__().transpose(axes)
+        return Derived(lambda block: block.transpose(axes), self)
+
+    def max(self, axis = None, **kwargs):
+        if axis != None or len(kwargs) > 0:
+            return self.__array__().max(axis, **kwargs)
+        return amax([block.max() for _, _, block in self.blocks()])
+
+    def min(self, axis = None, **kwargs):
+        if axis != None or len(kwargs) > 0:
+            return self.__array__().min(axis, **kwargs)
+        return amin([block.min() for _, _, block in self.blocks()])
+
+    def __add__(self, other):       return add(self, other)
+    def __radd__(self, other):      return add(other, self)
+    def __sub__(self, other):       return subtract(self, other)
+    def __rsub__(self, other):      return subtract(other, self)
+    def __mul__(self, other):       return multiply(self, other)
+    def __rmul__(self, other):      return multiply(other, self)
+    def __truediv__(self, other):   return true_divide(self, other)
+    def __rtruediv__(self, other):  return true_divide(other, self)
+    def __pow__(self, other):       return power(self, other)
+    def __neg__(self):              return negative(self)
+    def __abs__(self):              return absolute(self)
+
+
+class Field (Lazy):
+    '''
+    A variable of the netCDF file (or any array with the time in the first axis)
+    that is read by blocks of time steps only when they are used.
+    The FELTOR outputs are saved as (time, y, x), so by default the blocks are
+    transposed to (time, x, y) as the rest of the analysis expects.
+    The blocks read are kept in a cache that never uses more than memory bytes.
+    With dtype, the values are converted to that type (e.g. float32) when read.
+    '''
+
+    def __init__(self, variable, crop = 1, offset = 0, sign = 1, transpose = True, memory = 2 ** 30, dtype = None):
+        self.variable  = variable
+        self.offset    = offset
+        self.sign      = sign
+        self.transpose_source = transpose
+        self.times     = range(0, variable.shape[0], crop)
+        self.dtype     = asarray(variable[:0], dtype).dtype
+        shape          = tuple(variable.shape[1:])
+        self.frame_shape = shape[:-2] + shape[:-3:-1] if transpose and len(shape) >= 2 else shape
+
+        self.memory    = memory
+        frame_bytes    = max(1, int(prod(self.frame_shape)) * self.dtype.itemsize)
+        self.block     = max(1, int(memory // (4 * frame_bytes)))
+        self.cache     = OrderedDict()
+        self.cache_bytes = [0]   ## In a list so the views of the field share it
+
+    def _fetch(self, start, stop, step):
+        '''
+        Read from the source and put the values in the (time, x, y) form
+        '''
+        block = asarray(self.variable[start:stop:step])
+        if not isinstance(self.variable, ndarray):
+            count(block.nbytes)
+        ## The sign and offset are applied in place, unless the block is a view of an array
+        owned = not isinstance(self.variable, ndarray) or block.dtype != self.dtype
+        block = block.astype(self.dtype, copy = False)
+        if self.transpose_source and block.ndim >= 3:
+            block = block.swapaxes(-1, -2)
+        if self.sign != 1:
+            block = multiply(block, self.sign, out = block if owned else None)
+        if self.offset != 0:
+            block = add(block, self.offset, out = block if owned else None, casting = 'unsafe')
+        return block
+
+    def _cached(self, step, phase, number):
+        '''
+        Get the block number of the time steps phase + step * j from the cache,
+        reading it if necessary and evicting the oldest blocks when the memory
+        budget is exceeded
+        '''
+        key = (step, phase, number)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+
+        start = phase + step * number * self.block
+        stop  = min(phase + step * (number + 1) * self.block, self.variable.shape[0])
+        block = self._fetch(start, stop, step)
+        block.flags.writeable = False
+
+        self.cache[key]      = block
+        self.cache_bytes[0] += block.nbytes
+        while self.cache_bytes[0] > self.memory and len(self.cache) > 1:
+            _, old = self.cache.popitem(last = False)
+            self.cache_bytes[0] -= old.nbytes
+        return block
+
+    def _load(self, times):
+        step, phase = times.step, times.start % times.step
+        first, last = times.start // step, times.start // step + len(times)
+        pieces      = []
+        for number in range(first // self.block, (last - 1) // self.block + 1):
+            block = self._cached(step, phase, number)
+            begin = max(first - number * self.block, 0)
+            end   = min(last  - number * self.block, len(block))
+            pieces.append(block[begin:end])
+        return pieces[0] if len(pieces) == 1 else concatenate(pieces)
+
+
+class Derived (Lazy):
+    '''
+    A lazy field computed block by block from other fields, e.g. the radial
+    velocity from the potential or the product of two fields. The function gets
+    the blocks of the lazy sources (the rest of the arguments are passed as they are)
+    and it should not mix different time steps.
+    '''
+
+    def __init__(self, function, *sources):
+        lazy = [source for source in sources if isinstance(source, Lazy)]
+        nt   = len(lazy[0])
+        if any(len(source) != nt for source in lazy):
+            raise ValueError('All the lazy fields should have the same number of time steps')
+
+        ## Arrays with the full time axis are read by blocks too
+        self.sources  = [Field(source, transpose = False) if isinstance(source, ndarray) and
+                         ndim(source) == lazy[0].ndim and len(source) == nt else source for source in sources]
+        self.function = function
+        self.times    = range(nt)
+        self.block    = min(source.block for source in self.sources if isinstance(source, Lazy))
+
+        ## A single empty frame is enough to know the shape and type of the result
+        with errstate(all = 'ignore'):
+            dummy = function(*[ones((1,) + tuple(source.frame_shape), source.dtype) if isinstance(source, Lazy)
+                               else source for source in self.sources])
+        self.frame_shape = dummy.shape[1:]
+        self.dtype       = dummy.dtype
+
+    def _load(self, times):
+        return self.function(*[source._read(source.times[times.start:times.stop:times.step])
+                               if isinstance(source, Lazy) else source for source in self.sources])
+
+
+def _own(block):
+    '''
+    The blocks coming from the cache are read only, give a copy of them
+    '''
+    return block if block.flags.writeable else block.copy()
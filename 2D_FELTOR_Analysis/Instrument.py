@@ -0,0 +1,188 @@
+'''
+Instrumentation of the analysis and of the GIF pipelines: the stages (loading an
+output, every diagnostic, the rendering of the frames...) are measured with the
+context manager stage or the decorator timed, and for every one it is recorded
+the wall time, the bytes of the fields read from the netCDF files (netcdf_bytes,
+counted by Fields and Analyse.load), all the bytes read by the process (read_bytes,
+also fonts, images...) and its peak of resident memory. The report is saved as
+json, gathered from all the ranks under MPI.
+    with stage('Flux_plot'):
+        ...
+    @timed('Analyzed')
+    def Analyzed(...):
+        ...
+    recorder.dump('profile_IC.json', comm)
+The stages can be nested, and the time of a stage includes the one of the stages
+inside it. The bytes read and the memory are taken from /proc (Linux), elsewhere
+they fall back to getrusage (blocks read from disk and peak of the whole process).
+'''
+
+from contextlib        import contextmanager
+from functools         import wraps
+from json              import dump
+from os                import getpid
+from socket            import gethostname
+from time              import perf_counter
+from resource          import getrusage, RUSAGE_SELF
+from sys               import platform
+
+
+def read_bytes():
+    '''
+    Bytes read by the process up to now, read() and pread() calls included the
+    ones served from the page cache, which is what HDF5 does for netCDF4 (the
+    reads of /proc by the instrumentation add a few kB)
+    '''
+    try:
+        with open('/proc/self/io') as file:
+            for line in file:
+                if line.startswith('rchar'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return getrusage(RUSAGE_SELF).ru_inblock * 512
+
+def peak_rss():
+    '''
+    Peak of resident memory in bytes since it was last reset
+    '''
+    try:
+        with open('/proc/self/status') as file:
+            for line in file:
+                if line.startswith('VmHWM'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    ## ru_maxrss is in kB in Linux and in bytes in macOS
+    return getrusage(RUSAGE_SELF).ru_maxrss * (1 if platform == 'darwin' else 1024)
+
+def reset_peak_rss():
+    '''
+    Reset the peak of resident memory to the current one (Linux >= 4.0), so the
+    peak of every stage is its own and not the one of the whole process
+    '''
+    try:
+        with open('/proc/self/clear_refs', 'w') as file:
+            file.write('5')
+    except OSError:
+        pass
+
+
+class Instrument ():
+    '''
+    Record of the stages of a run, by name: number of calls, wall time (seconds),
+    bytes read from netCDF and in total and peak of resident memory (bytes, the
+    largest of all the calls).
+    '''
+
+    def __init__(self):
+        self.stages = {}
+        self.stack  = []    ## [peak, netcdf_bytes] of the open stages, the nested ones do not hide them
+        self.start  = perf_counter()
+
+    def reset(self):
+        '''
+        Forget all the stages recorded
+        '''
+        self.__init__()
+
+    @contextmanager
+    def stage(self, name):
+        '''
+        Context manager measuring the code inside it as the stage name
+        '''
+        if self.stack:
+            self.stack[-1][0] = max(self.stack[-1][0], peak_rss())
+        reset_peak_rss()
+        self.stack.append([0, 0])
+        tic, bytes_0 = perf_counter(), read_bytes()
+        try:
+            yield
+        finally:
+            seconds, bytes_read = perf_counter() - tic, read_bytes() - bytes_0
+            peak, netcdf_bytes = self.stack.pop()
+            peak = max(peak, peak_rss())
+            if self.stack:
+                self.stack[-1][0] = max(self.stack[-1][0], peak)
+
+            record = self.stages.setdefault(name, {'calls': 0, 'seconds': 0, 'netcdf_bytes': 0, 'read_bytes': 0,
+                                                   'peak_rss': 0})
+            record['calls']        += 1
+            record['seconds']      += seconds
+            record['netcdf_bytes'] += netcdf_bytes
+            record['read_bytes']   += bytes_read
+            record['peak_rss']      = max(record['peak_rss'], peak)
+
+    def count(self, nbytes):
+        '''
+        Add nbytes read from a netCDF file to all the stages open
+        '''
+        for entry in self.stack:
+            entry[1] += nbytes
+
+    def timed(self, name = None):
+        '''
+        Decorator measuring every call of the function as the stage name (the
+        qualified name of the function by default)
+        '''
+        def decorator(function):
+            label = function.__qualname__ if name == None else name
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.stage(label):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def report(self):
+        '''
+        Dictionary with the stages and the totals of the process
+        '''
+        return {'host': gethostname(), 'pid': getpid(), 'seconds': perf_counter() - self.start,
+                'read_bytes': read_bytes(), 'stages': {name: dict(record) for name, record in self.stages.items()}}
+
+    def dump(self, File_name, comm = None, **extra):
+        '''
+        Save the report as json in File_name, with the entries of extra. With an
+        MPI communicator it is collective: the reports of all the ranks are gathered
+        in the rank 0, which saves them together with their aggregate.
+        '''
+        report = {**extra, **self.report()}
+        if comm != None:
+            reports = comm.gather(report, root = 0)
+            if comm.Get_rank() != 0:
+                return
+            report = {**extra, 'ranks': reports, 'total': aggregate(reports)}
+
+        with open(File_name, 'w') as file:
+            dump(report, file, indent = 1)
+
+
+def aggregate(reports):
+    '''
+    Stages of several ranks together: the calls, time and bytes read are summed,
+    the time of the slowest rank is kept as seconds_max (the one the run waits for)
+    and the memory as the largest peak of a rank (peak_rss) and their sum (peak_rss_sum)
+    '''
+    stages = {}
+    for report in reports:
+        for name, record in report['stages'].items():
+            total = stages.setdefault(name, {'ranks': 0, 'calls': 0, 'seconds': 0, 'seconds_max': 0,
+                                             'netcdf_bytes': 0, 'read_bytes': 0, 'peak_rss': 0, 'peak_rss_sum': 0})
+            total['ranks']        += 1
+            total['calls']        += record['calls']
+            total['seconds']      += record['seconds']
+            total['seconds_max']   = max(total['seconds_max'], record['seconds'])
+            total['netcdf_bytes'] += record['netcdf_bytes']
+            total['read_bytes']   += record['read_bytes']
+            total['peak_rss']      = max(total['peak_rss'], record['peak_rss'])
+            total['peak_rss_sum'] += record['peak_rss']
+    return {'seconds': max(report['seconds'] for report in reports),
+            'read_bytes': sum(report['read_bytes'] for report in reports), 'stages': stages}
+
+
+## The record of this process, shared by all the modules
+recorder = Instrument()
+stage    = recorder.stage
+timed    = recorder.timed
+count    = recorder.count
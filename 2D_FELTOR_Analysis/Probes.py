@@ -0,0 +1,132 @@
+from netCDF4           import Dataset
+from scipy.signal      import welch, csd
+from scipy.stats       import skew, kurtosis
+from scipy.fft         import rfft, irfft, next_fast_len
+from numpy             import asarray, copy, arange, average, std, absolute, angle, conjugate
+from numpy             import diff, median, hypot, argmax, take_along_axis, clip, where
+
+
+class Probes ():
+    '''
+    Class to open and analyse the probes of the 2D FELTOR simulations, the file
+    output_<model>_prbs.nc, with the fields saved at every time step in a few
+    points of the grid. The probe series are (time, probe) arrays, and every
+    diagnostic is done at once for all the probes (or pairs of probes).
+    The netCDF4 variables are chunked along the unlimited time dimension, so they
+    can not be memory-mapped: each series is read in a single call the first time
+    it is used and kept, which is cheap as they are orders of magnitude smaller
+    than the fields.
+    '''
+
+    def __init__ (self, File_name, Access_Mode = 'r'):
+        '''
+        Open the probes file and read the times and positions of the probes
+        '''
+        self.Data   = Dataset(File_name, Access_Mode, format="NETCDF4")
+        self.time   = copy(self.Data['energy_time'][:])
+        self.nt     = len(self.time)
+        self.x      = copy(self.Data['Probes_x'][:])
+        self.y      = copy(self.Data['Probes_y'][:])
+        self.n_prb  = len(self.x)
+        self.dt     = median(diff(self.time)) if self.nt > 1 else 0
+        self.series = {}
+
+    def __getitem__(self, name):
+        '''
+        The (time, probe) series of the field name (ions, potential, vorticity, vr),
+        read the first time it is asked
+        '''
+        if name not in self.series:
+            self.series[name] = copy(self.Data[f'{name}_probes'][:])
+        return self.series[name]
+
+    def get(self, f):
+        '''
+        The series given by its name, or the array itself
+        '''
+        return self[f] if type(f) == str else asarray(f)
+
+    def psd(self, f, fs = None, **kwargs):
+        '''
+        Power spectral density of every probe, as (frequency, probe), with the
+        Welch method and the same defaults as Analyse.cpsd
+        '''
+        fs = 1 / self.dt if fs == None else fs
+        kwargs.setdefault('window', 'hamming')
+        freq, P = welch(self.get(f), fs, axis = 0, **kwargs)
+        return P, freq
+
+    def cpsd(self, f, g, fs = None, **kwargs):
+        '''
+        Cross-power spectral density between the fields f and g in every probe,
+        given as amplitude and phase (frequency, probe), as in Analyse.cpsd
+        '''
+        fs = 1 / self.dt if fs == None else fs
+        kwargs.setdefault('window', 'hamming')
+        freq, PFG = csd(self.get(f), self.get(g), fs, axis = 0, **kwargs)
+        return absolute(PFG), angle(PFG), freq
+
+    def correlation(self, f, g, steps = None):
+        '''
+        Cross-correlation <f(t) g(t - i)> / (sigma_f sigma_g) between the
+        fluctuations of f and g in the same probe, for the delays i in
+        [-steps, steps] (all the ones with half of the signal by default).
+        It is done with an FFT of the whole series, zero padded so it is not circular,
+        and normalised by the number of products of every delay.
+        Gives the correlation (delay, probe) and the delays in time units.
+        '''
+        f, g  = self.get(f), self.get(g)
+        nt    = len(f)
+        steps = (nt - 1) // 2 if steps == None else min(int(steps), nt - 1)
+        f, g  = f - average(f, axis = 0), g - average(g, axis = 0)
+
+        n_fft = next_fast_len(2 * nt - 1)
+        corr  = irfft(rfft(f, n_fft, axis = 0) * conjugate(rfft(g, n_fft, axis = 0)), n_fft, axis = 0)
+        lags  = arange(-steps, steps + 1)
+        corr  = corr[lags % n_fft] / (nt - absolute(lags)).reshape(-1, 1)
+        corr /= where(std(f, axis = 0) * std(g, axis = 0) > 0, std(f, axis = 0) * std(g, axis = 0), 1)
+        return corr, lags * self.dt
+
+    def autocorrelation(self, f, steps = None):
+        '''
+        Autocorrelation of the fluctuations of f in every probe, see correlation
+        '''
+        return self.correlation(f, f, steps)
+
+    def moments(self, f):
+        '''
+        Mean, standard deviation, skewness and (excess) kurtosis of the probability
+        distribution of f in every probe
+        '''
+        f = self.get(f)
+        return {'mean': average(f, axis = 0), 'std': std(f, axis = 0),
+                'skewness': skew(f, axis = 0), 'kurtosis': kurtosis(f, axis = 0)}
+
+    def velocity(self, f = 'ions', pairs = None, steps = None):
+        '''
+        Velocity of the structures from the time delay between probes: the delay
+        of maximum cross-correlation of f between the probes of every pair (by default
+        the neighbours in the order of the input), refined with a parabola through the
+        maximum, and the distance between the probes over it. A positive velocity
+        goes from the first probe of the pair to the second one.
+        Gives the velocities, the delays (both one per pair) and the pairs.
+        '''
+        if pairs == None:
+            pairs = [(i, i + 1) for i in range(self.n_prb - 1)]
+        first, second = asarray(pairs).T
+
+        f     = self.get(f)
+        nt    = len(f)
+        steps = (nt - 1) // 2 if steps == None else min(int(steps), nt - 1)
+        corr, _ = self.correlation(f[:, second], f[:, first], steps)
+
+        ## The maximum and a parabola through it and its neighbours
+        peak   = clip(argmax(corr, axis = 0), 1, 2 * steps - 1)
+        c0, c1, c2 = [take_along_axis(corr, (peak + i).reshape(1, -1), axis = 0)[0] for i in [-1, 0, 1]]
+        curve  = c0 - 2 * c1 + c2
+        shift  = where(curve < 0, 0.5 * (c0 - c2) / where(curve < 0, curve, -1), 0)
+        delay  = (peak - steps + shift) * self.dt
+
+        distance = hypot(self.x[second] - self.x[first], self.y[second] - self.y[first])
+        velocity = distance / where(delay != 0, delay, float('nan'))
+        return velocity, delay, pairs
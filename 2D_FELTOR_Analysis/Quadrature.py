@@ -0,0 +1,61 @@
+from numpy.polynomial.legendre import leggauss
+from numpy             import arange, tile, outer, tensordot, allclose, shape
+
+
+def dg_weights(n, N, x0, x1):
+    '''
+    Nodes and weights of the Gauss-Legendre quadrature in the discontinuous
+    Galerkin grid of FELTOR: N cells between x0 and x1 with n nodes per cell.
+    These are the same nodes as the x and y saved in the output file.
+    '''
+    nodes, weights = leggauss(n)
+    h = (x1 - x0) / N
+    x = (x0 + h * arange(N).reshape(N, 1) + h / 2 * (nodes + 1)).ravel()
+    w = tile(h / 2 * weights, N)
+    return x, w
+
+
+class Quadrature ():
+    '''
+    Integrals over the output grid of FELTOR. The fields are polynomials of
+    order n_out - 1 in every cell, so the Gauss-Legendre quadrature with the
+    n_out nodes per cell is exact. The weights are computed once for the grid,
+    so every integral is a single contraction (tensordot) with them.
+    The fields are expected as (..., x, y), as in Analyse.
+    '''
+
+    def __init__(self, n_out, Nx_out, Ny_out, lx, ly, x0 = 0, y0 = 0):
+        self.x, self.wx = dg_weights(n_out, Nx_out, x0, x0 + lx)
+        self.y, self.wy = dg_weights(n_out, Ny_out, y0, y0 + ly)
+        self.wxy        = outer(self.wx, self.wy)
+
+    @classmethod
+    def from_input(cls, input):
+        '''
+        Create the quadrature from the input dictionary of the simulation
+        '''
+        return cls(input['n_out'], input['Nx_out'], input['Ny_out'], input['lx'], input['ly'])
+
+    def matches(self, x, y):
+        '''
+        Check if the coordinates x and y are the nodes of this quadrature
+        '''
+        return shape(x) == shape(self.x) and shape(y) == shape(self.y) and allclose(x, self.x) and allclose(y, self.y)
+
+    def x_integral(self, f, axis = -2):
+        '''
+        Integral over x, that should be the axis given
+        '''
+        return tensordot(f, self.wx, axes = ([axis], [0]))
+
+    def y_integral(self, f, axis = -1):
+        '''
+        Integral over y, that should be the axis given
+        '''
+        return tensordot(f, self.wy, axes = ([axis], [0]))
+
+    def integral(self, f):
+        '''
+        Integral over x and y, the two last axes of f
+        '''
+        return tensordot(f, self.wxy, axes = ([-2, -1], [0, 1]))
@@ -0,0 +1,138 @@
+from netCDF4           import Dataset
+from json              import loads
+from operator          import index
+from numpy             import asarray, concatenate, allclose, shape, searchsorted
+
+## Parameters of the input that have to be the same in all the segments of a run
+grid_keys  = ['model', 'modified', 'n_out', 'Nx_out', 'Ny_out', 'lx', 'ly']
+time_dims  = ['time', 'energy_time']
+
+
+class Concatenated ():
+    '''
+    Several outputs of the same simulation (restarted because of the time limit
+    of the queue) seen as a single netCDF Dataset along the time. The files are
+    ordered by their first time, and the times of a file already covered by the
+    previous ones (the initial condition of a restart) are dropped.
+    Nothing is copied, the reads are done in the file holding the time steps asked.
+    The variables without a time dimension are taken from the first file.
+    The rest of arguments are passed to the Dataset of every file.
+    '''
+
+    def __init__(self, File_names, Access_Mode = 'r', **kwargs):
+        self.files = [Dataset(name, Access_Mode, format="NETCDF4", **kwargs) for name in File_names]
+        self.files.sort(key = lambda file: float(file['time'][0]))
+        self.inputfile = self.files[0].inputfile
+        self.check()
+
+        ## The time steps kept from every file, for each of the time dimensions
+        self.kept = {}
+        for dim in time_dims:
+            if all(dim in file.variables for file in self.files):
+                self.kept[dim] = self.segments([asarray(file[dim][:]) for file in self.files])
+
+    def check(self):
+        '''
+        All the files should be the same simulation, with the same grid
+        '''
+        input = loads(self.inputfile)
+        x, y  = asarray(self.files[0]['x'][:]), asarray(self.files[0]['y'][:])
+        for file in self.files[1:]:
+            other = loads(file.inputfile)
+            for key in grid_keys:
+                if input.get(key) != other.get(key):
+                    raise ValueError(f'The outputs are not the same simulation, {key} is {input.get(key)} and {other.get(key)}')
+            if shape(file['x']) != shape(x) or shape(file['y']) != shape(y) or \
+               not allclose(file['x'][:], x) or not allclose(file['y'][:], y):
+                raise ValueError('The outputs do not have the same grid')
+
+    @staticmethod
+    def segments(times):
+        '''
+        The first time step kept of each file: the ones after the last time
+        of the previous files
+        '''
+        firsts, last = [], None
+        for time in times:
+            first = 0 if last == None else int(searchsorted(time, last, side = 'right'))
+            firsts.append(first)
+            if first < len(time):
+                last = time[-1]
+        return firsts
+
+    def __getitem__(self, name):
+        dims = self.files[0][name].dimensions
+        if len(dims) == 0 or dims[0] not in self.kept:
+            return self.files[0][name]
+        return Segmented([file[name] for file in self.files], self.kept[dims[0]])
+
+    def __contains__(self, name):
+        return name in self.files[0].variables
+
+    @property
+    def variables(self):
+        return {name: self[name] for name in self.files[0].variables}
+
+    def close(self):
+        for file in self.files:
+            file.close()
+
+
+class Segmented ():
+    '''
+    A variable split in several files, it behaves as the netCDF variable of the
+    whole run: it has a shape and it can be sliced (the time axis, the first one,
+    with an integer, a slice or a list of positions)
+    '''
+
+    def __init__(self, variables, firsts):
+        self.variables  = variables
+        self.firsts     = firsts
+        self.lengths    = [max(0, variable.shape[0] - first) for variable, first in zip(variables, firsts)]
+        self.starts     = [sum(self.lengths[:i]) for i in range(len(self.lengths))]
+        self.dimensions = variables[0].dimensions
+        self.dtype      = variables[0].dtype
+
+    @property
+    def shape(self):
+        return (sum(self.lengths),) + tuple(self.variables[0].shape[1:])
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if type(key) != tuple:
+            key = (key,)
+        time, rest = key[0], key[1:]
+
+        try:
+            position = index(time)
+        except TypeError:
+            pass
+        else:
+            if position < -len(self) or position >= len(self):
+                raise IndexError(f'index {position} is out of bounds for axis 0 with size {len(self)}')
+            position %= len(self)
+            segment   = searchsorted(self.starts, position, side = 'right') - 1
+            return self.variables[segment][(self.firsts[segment] + position - self.starts[segment],) + rest]
+
+        if type(time) == slice:
+            times = range(len(self))[time]
+            if times.step < 0:
+                return self[(slice(times[-1], times[0] + 1, -times.step),) + rest][::-1] if len(times) else \
+                       self[(slice(0, 0),) + rest]
+            pieces = []
+            for variable, first, start, length in zip(self.variables, self.firsts, self.starts, self.lengths):
+                ## The first position of the slice in this segment, and where it ends
+                begin = times.start if times.start >= start else \
+                        times.start - (times.start - start) // times.step * times.step
+                end   = min(times.stop, start + length)
+                if begin < end:
+                    pieces.append(asarray(variable[(slice(first + begin - start, first + end - start, times.step),) + rest]))
+            if len(pieces) == 0:
+                return asarray(self.variables[0][(slice(0, 0),) + rest])
+            return pieces[0] if len(pieces) == 1 else concatenate(pieces)
+
+        positions = range(len(self))
+        return concatenate([self[(int(positions[i]),) + rest][None] for i in asarray(time).ravel()]) \
+               if asarray(time).size > 0 else asarray(self.variables[0][(slice(0, 0),) + rest])
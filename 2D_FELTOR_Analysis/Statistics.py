@@ -0,0 +1,122 @@
+from numpy             import zeros, full, linspace, tensordot, floor, where, bincount, broadcast_to, arange
+from numpy             import sqrt, array_equal, errstate, amin, amax
+
+
+class Accumulator ():
+    '''
+    Statistics of a field at every x (over the time and y), accumulated block by
+    block in a single pass: the weighted mean and central moments up to the fourth
+    order, merged with the formulas of Welford and Pebay, and a histogram with fixed
+    bins. Two accumulators of different blocks, files or processes are merged
+    with merge, which gives the same result as if all the values were added to one.
+    The values of y are weighted (with the quadrature weights, so the averages are
+    the ones of integrate over y), the time steps all count the same.
+    The bins are edges, or bins bins in range. Without them, the range is the one of
+    the first block widened by its width on each side, and the values out of it
+    are counted in under and over.
+    '''
+
+    def __init__(self, nx, bins = 100, range = None, edges = None):
+        self.W, self.mean = zeros(nx), zeros(nx)
+        self.M2, self.M3, self.M4 = zeros(nx), zeros(nx), zeros(nx)
+        self.bins   = bins if edges is None else len(edges) - 1
+        self.edges  = edges if edges is not None else None if range == None else linspace(range[0], range[1], bins + 1)
+        self.counts = zeros((nx, self.bins))
+        self.under, self.over = zeros(nx), zeros(nx)
+
+    def _merge_moments(self, W, mean, M2, M3, M4):
+        '''
+        Merge the moments of another set of values (per x) with the ones kept
+        '''
+        Wa, Wb = self.W, W
+        Wt     = Wa + Wb
+        with errstate(invalid = 'ignore', divide = 'ignore'):
+            fa, fb = where(Wt > 0, Wa / Wt, 0), where(Wt > 0, Wb / Wt, 0)
+        delta  = mean - self.mean
+
+        self.M4 = (self.M4 + M4 + delta ** 4 * Wa * fb * (fa ** 2 - fa * fb + fb ** 2)
+                   + 6 * delta ** 2 * (fa ** 2 * M2 + fb ** 2 * self.M2) + 4 * delta * (fa * M3 - fb * self.M3))
+        self.M3 = (self.M3 + M3 + delta ** 3 * Wa * fb * (fa - fb) + 3 * delta * (fa * M2 - fb * self.M2))
+        self.M2 = self.M2 + M2 + delta ** 2 * Wa * fb
+        self.mean, self.W = self.mean + delta * fb, Wt
+
+    def add(self, values, weights):
+        '''
+        Add a block of values (time, x, y) with the weights of y
+        '''
+        nt     = len(values)
+        W      = full(values.shape[1], nt * weights.sum())
+        mean   = tensordot(values, weights, axes = ([-1], [0])).sum(axis = 0) / W
+        delta  = values - mean.reshape(1, -1, 1)
+        powers = [tensordot(delta ** i, weights, axes = ([-1], [0])).sum(axis = 0) for i in [2, 3, 4]]
+        self._merge_moments(W, mean, *powers)
+
+        if self.edges is None:
+            self.widened(amin(values), amax(values))
+
+        ## The bin of every value, the ones in the last edge go to the last bin
+        width   = (self.edges[-1] - self.edges[0]) / self.bins
+        index   = floor((values - self.edges[0]) / width).astype(int)
+        index   = where(values == self.edges[-1], self.bins - 1, index)
+        w       = broadcast_to(weights, values.shape)
+        below, above = index < 0, index >= self.bins
+        self.under += (w * below).sum(axis = (0, 2))
+        self.over  += (w * above).sum(axis = (0, 2))
+
+        inside  = ~(below | above)
+        x_index = broadcast_to(arange(values.shape[1]).reshape(1, -1, 1), values.shape)
+        self.counts += bincount((x_index * self.bins + index)[inside], w[inside],
+                                minlength = self.counts.size).reshape(self.counts.shape)
+        return self
+
+    def widened(self, low, high):
+        '''
+        Set the bins between low and high widened by their width on each side
+        '''
+        width      = high - low if high > low else max(abs(low), 1)
+        self.edges = linspace(low - width, high + width, self.bins + 1)
+        return self
+
+    def merge(self, other):
+        '''
+        Merge the statistics of another accumulator, with the same bins
+        '''
+        if other.W.sum() == 0:
+            return self
+        if self.W.sum() == 0 and self.edges is None:
+            self.edges = other.edges
+        if not array_equal(self.edges, other.edges):
+            raise ValueError('The accumulators should have the same bins to be merged.')
+        self._merge_moments(other.W, other.mean, other.M2, other.M3, other.M4)
+        self.counts += other.counts
+        self.under  += other.under
+        self.over   += other.over
+        return self
+
+    def result(self):
+        '''
+        Dictionary of profiles in x: mean, std, rms (of the values, not of their
+        fluctuations), skewness and (excess) kurtosis, and the pdf (x, bin) with its
+        edges, normalised so its integral over the edges is one at every x, minus
+        the fraction of the values out of them (in under and over).
+        '''
+        with errstate(invalid = 'ignore', divide = 'ignore'):
+            variance = self.M2 / self.W
+            width    = (self.edges[1:] - self.edges[:-1]).reshape(1, -1)
+            return {'mean': self.mean, 'std': sqrt(variance), 'rms': sqrt(variance + self.mean ** 2),
+                    'skewness': (self.M3 / self.W) / variance ** 1.5,
+                    'kurtosis': (self.M4 / self.W) / variance ** 2 - 3,
+                    'pdf': self.counts / (self.W.reshape(-1, 1) * width), 'edges': self.edges,
+                    'under': self.under / self.W, 'over': self.over / self.W, 'weight': self.W}
+
+
+def merged(accumulators):
+    '''
+    A single accumulator with the statistics of all the ones given (e.g. of every
+    process or of every file of a scan)
+    '''
+    accumulators = list(accumulators)
+    total = Accumulator(len(accumulators[0].W), accumulators[0].bins)
+    for accumulator in accumulators:
+        total.merge(accumulator)
+    return total
@@ -0,0 +1,166 @@
+'''
+Synthetic outputs of FELTOR, with the same layout as the ones of convection_hpc
+(inputfile, time, x and y in the DG nodes, electrons, ions, potential, vorticity
+and the invariants in energy_time, and the probes file), so the analysis can be
+tested and measured without a simulation. The fields are a blob moving in x
+plus drifting turbulent modes periodic in y, given analytically.
+It can be used as a module, write(File_name, input), or from the command line:
+    python Synthetic.py output_HW.nc -i input.json --probes
+'''
+
+from FELTOR_class      import data_example
+from Quadrature        import dg_weights
+from netCDF4           import Dataset
+from json              import dumps, load
+from argparse          import ArgumentParser
+from numpy             import arange, exp, sin, cos, pi, zeros, array, linspace, float64
+from numpy.random      import default_rng
+
+## Parameters of the newer inputs of FELTOR missing in data_example (as in FELTOR-model/input_IC.json)
+input_example     = {**data_example, 'x_a': 0.05, 'x_b': 0.5, 'x_c': 0.9, 'nb': 0, 'bc_x_phi': 'DIR_NEU', 'bc_y_phi': 'PER'}
+
+## Parameters of the synthetic fields, they are not used by FELTOR
+synthetic_example = {'blob_velocity': 0.5,   ## radial velocity of the blob
+                     'turbulence'   : 0.1,   ## amplitude of the turbulent modes
+                     'modes'        : 8,     ## number of turbulent modes
+                     'seed'         : 0}
+
+
+class Synthetic ():
+    '''
+    Fields of a synthetic simulation from an input dictionary as the one of FELTOR
+    (FELTOR_class.data_example by default, with x_a, x_b, x_c and nb). The size of
+    the output is given by n_out, Nx_out, Ny_out, lx and ly, the number of frames by
+    maxout (plus the initial one) and the invariants are saved every dt, itstp times
+    per frame.
+    The blob is given by amplitude, sigma, posX and posY, over a background nb.
+    '''
+
+    def __init__(self, input = None):
+        self.input = {**input_example, **synthetic_example, **({} if input == None else input)}
+        p = self.input
+        self.x, _ = dg_weights(p['n_out'], p['Nx_out'], 0, p['lx'])
+        self.y, _ = dg_weights(p['n_out'], p['Ny_out'], 0, p['ly'])
+        self.time        = p['dt'] * p['itstp'] * arange(p['maxout'] + 1)
+        self.energy_time = p['dt'] * arange(p['maxout'] * p['itstp'] + 1)
+
+        ## Modes periodic in y (and fitting in x), with random amplitudes, phases and frequencies
+        rng     = default_rng(p['seed'])
+        self.kx = 2 * pi * rng.integers(1, 4, p['modes']) / p['lx']
+        self.ky = 2 * pi * rng.integers(1, max(2, p['Ny_out'] // 4), p['modes']) / p['ly']
+        self.omega = rng.uniform(-1, 1, p['modes'])
+        self.phase = rng.uniform(0, 2 * pi, p['modes'])
+        self.amp   = p['turbulence'] * rng.uniform(0.5, 1, p['modes'])
+
+    def fields(self, x, y, t):
+        '''
+        ions, potential, vorticity and radial velocity at the points (x, y), which
+        should broadcast, at the time t
+        '''
+        p    = self.input
+        s    = 2 * p['sigma'] ** 2
+        u, v = x - p['posX'] * p['lx'] - p['blob_velocity'] * t, y - p['posY'] * p['ly']
+        blob = p['amplitude'] * exp(-(u ** 2 + v ** 2) / s) * exp(-p['nu_perp'] * t)
+
+        ## The potential of the blob is a dipole in y, its vorticity is the laplacian
+        ions      = p['nb'] + blob + zeros(x.shape) + zeros(y.shape)
+        potential = v * blob
+        vorticity = v * blob * (4 * (u ** 2 + v ** 2) / s ** 2 - 8 / s)
+        v_r       = -blob * (1 - 2 * v ** 2 / s)
+        for kx, ky, omega, phase, amp in zip(self.kx, self.ky, self.omega, self.phase, self.amp):
+            mode       = amp * sin(kx * x) * cos(ky * y - omega * t + phase)
+            ions       = ions + mode
+            potential  = potential + mode
+            vorticity  = vorticity - (kx ** 2 + ky ** 2) * mode
+            v_r        = v_r + amp * sin(kx * x) * ky * sin(ky * y - omega * t + phase)
+        return {'ions': ions, 'potential': potential, 'vorticity': vorticity, 'vr': v_r}
+
+    def invariants(self):
+        '''
+        Invariants and their dissipation in energy_time, the dissipation is the
+        derivative of the invariants so the energy balance is exact
+        '''
+        p, t  = self.input, self.energy_time
+        blob  = p['amplitude'] * pi * p['sigma'] ** 2 * 2
+        decay = exp(-p['nu_perp'] * t)
+        values = {'mass':      p['lx'] * p['ly'] * p['nb'] + blob * decay,
+                  'entropy':   blob * decay ** 2,
+                  'kinetic':   blob * (1 - decay ** 2) / 2,
+                  'curvature': -p['curvature'] * blob * decay}
+        values.update({'mass_diss':      -p['nu_perp'] * blob * decay,
+                       'entropy_diss':   -2 * p['nu_perp'] * blob * decay ** 2,
+                       'kinetic_diss':   p['nu_perp'] * blob * decay ** 2,
+                       'curvature_diss': p['nu_perp'] * p['curvature'] * blob * decay})
+        return values
+
+    def probes(self):
+        '''
+        Positions of the probes, as convection_hpc they are indices of the
+        computational grid (n, Nx, Ny). By default a line of 8 probes in x at the
+        middle of y.
+        '''
+        p = self.input
+        x, _ = dg_weights(p['n'], p['Nx'], 0, p['lx'])
+        y, _ = dg_weights(p['n'], p['Ny'], 0, p['ly'])
+        probes = p.get('probes') or [[int(i), len(y) // 2] for i in linspace(0, len(x) - 1, 8)]
+        return array([x[i] for i, _ in probes]), array([y[j] for _, j in probes])
+
+    def write(self, File_name, probes = False):
+        '''
+        Write the output, frame by frame, and with probes also the probes file
+        (File_name with _prbs before .nc). Gives the names of the files written.
+        '''
+        data = Dataset(File_name, 'w', format = "NETCDF4")
+        data.inputfile = dumps(self.input, indent = 1)
+        data.createDimension('time', None); data.createDimension('energy_time', None)
+        data.createDimension('x', len(self.x)); data.createDimension('y', len(self.y))
+        for name, values in [('time', self.time), ('energy_time', self.energy_time), ('x', self.x), ('y', self.y)]:
+            data.createVariable(name, 'f8', (name,))[:] = values
+        for name, values in self.invariants().items():
+            data.createVariable(name, 'f8', ('energy_time',))[:] = values
+
+        variables = {name: data.createVariable(name, 'f8', ('time', 'y', 'x')) for name in
+                     ['electrons', 'ions', 'potential', 'vorticity']}
+        for i, t in enumerate(self.time):
+            fields = self.fields(self.x.reshape(1, -1), self.y.reshape(-1, 1), t)
+            fields['electrons'] = fields['ions']
+            for name, variable in variables.items():
+                variable[i] = fields[name]
+        data.close()
+
+        if not probes:
+            return [File_name]
+
+        prbs_name = File_name[:-3] + '_prbs.nc'
+        data = Dataset(prbs_name, 'w', format = "NETCDF4")
+        x, y = self.probes()
+        data.createDimension('energy_time', None); data.createDimension('Probes', len(x))
+        data.createVariable('energy_time', 'f8', ('energy_time',))[:] = self.energy_time
+        data.createVariable('Probes_x', 'f8', ('Probes',))[:] = x
+        data.createVariable('Probes_y', 'f8', ('Probes',))[:] = y
+        series = self.fields(x.reshape(1, -1), y.reshape(1, -1), self.energy_time.reshape(-1, 1))
+        for name in ['ions', 'potential', 'vorticity', 'vr']:
+            data.createVariable(f'{name}_probes', 'f8', ('energy_time', 'Probes'))[:] = series[name].astype(float64)
+        data.close()
+        return [File_name, prbs_name]
+
+
+def write(File_name, input = None, probes = False):
+    '''
+    Write a synthetic output from the input dictionary, see Synthetic
+    '''
+    return Synthetic(input).write(File_name, probes)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description = 'Write a synthetic output of FELTOR')
+    parser.add_argument('output', help = 'name of the output, e.g. output_IC.nc')
+    parser.add_argument('-i', '--input', default = None, help = 'json file with the input of the simulation')
+    parser.add_argument('--probes', action = 'store_true', help = 'write also the probes file')
+    arguments = parser.parse_args()
+
+    input = None
+    if arguments.input != None:
+        with open(arguments.input) as file:
+            input = load(file)
+    print(write(arguments.output, input, arguments.probes))
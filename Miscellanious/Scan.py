@@ -0,0 +1,265 @@
+'''
+Parameter scans of FELTOR from a declarative spec (a json file, see spec_example
+and the scans directory), instead of editing a copy of a submission script for
+every scan. The runs are the cartesian product of the lists in spec['scan'] (models,
+tokamaks of Tokamaks.csv, T_e or any parameter of the input, as nu_perp or Nx),
+their inputs are written once (the runs with the same input are done only once)
+and the runs are packed in SLURM jobs, several srun steps per allocation, so the
+small runs of a scan do not wait in the queue one by one.
+It can be used as a module, write(spec), or from the command line:
+    python Scan.py scans/nu_perp.json            ## write the inputs and the jobs
+    python Scan.py scans/nu_perp.json --dry-run  ## only list the runs
+    python Scan.py scans/nu_perp.json --submit   ## write them and submit them with sbatch
+'''
+
+from sys               import path
+from os.path           import join, dirname, abspath, basename, splitext
+path.insert(1, join(dirname(abspath(__file__)), '..', '2D_FELTOR_Analysis'))
+
+from Analysis          import units
+from argparse          import ArgumentParser
+from csv               import DictReader
+from itertools         import product
+from json              import dump, dumps, load
+from os                import makedirs
+from subprocess        import call
+from math              import ceil
+
+## Short names of the models for the SLURM jobs and the model of the input of FELTOR
+simply   = {"IC_HW_mod": "ICHWM", "IC_HW_ord": "ICHWO",
+            "HW_mod_IC": "HWMIC", "HW_ord_IC": "HWOIC",
+            "HW_mod": "HWM", "HW_ord": "HWO", "IC": "IC"}
+in_model = {"IC_HW_mod": "IC_HW", "IC_HW_ord": "IC_HW",
+            "HW_mod_IC": "HW_IC", "HW_ord_IC": "HW_IC",
+            "HW_mod": "HW", "HW_ord": "HW", "IC": "IC"}
+
+## The spec of a scan, every entry missing in a spec file is taken from here
+spec_example = {
+    'name'      : 'DIR_{ly}_ly_{lx}_lx_{nu_perp}_nu_{dt}_dt',   ## directory of the outputs of every run
+    'outputs'   : '/marconi_scratch/userexternal/crodrigu/hdiff_outputs',
+    'inputs'    : 'inputs/input_data_{model}.json',            ## base input of every model
+    'inputs_dir': 'inputs',                                    ## where the inputs of the runs are written
+    'submit_dir': 'submition',                                 ## where the jobs are written
+    'info_dir'  : 'info',
+    'tokamaks'  : 'characteristics/Tokamaks.csv',
+    'T_e'       : 20,
+    'scan'      : {'model': ['HW_mod', 'HW_ord', 'IC'], 'nu_perp': [1e-3]},
+    'set'       : {},          ## parameters of the input, '= lx / 2' is computed from the input
+    'curvature' : 0.015,       ## number, or 'kappa' of the tokamak, only for the models with IC
+    'adiabatic' : 0.05,        ## number, or 'alpha' of the tokamak
+    'program'   : './../Feltor_2D_Master_Thesis/FELTOR-model/convection_hpc',
+    'mpi'       : None,        ## {'np': 4, 'np0': 2, 'np1': 2} for convection_mpi
+    'slurm'     : {'partition': 'skl_fua_prod', 'account': 'FUA35_FELTOR', 'mem': 182000,
+                   'time': '24:00:00', 'hint': 'memory_bound', 'cores_per_node': 48,
+                   'cpus_per_task': 48, 'runs_per_job': 4},
+    'gif'       : False,       ## a GIF job for every directory, after its runs
+    'gif_program': '~/Plasma/prod/Python_GIF/GIF_main_mpi.py',
+    'setup'     : []           ## lines run by the jobs before the runs (module load ...)
+}
+
+
+#=====================================================================================
+# Runs of a scan
+#=====================================================================================
+
+def load_spec(File_name):
+    '''
+    The spec of the json file with the defaults of spec_example, and its name
+    '''
+    with open(File_name) as file:
+        spec = load(file)
+    slurm = {**spec_example['slurm'], **spec.get('slurm', {})}
+    return {**spec_example, 'scan_name': splitext(basename(File_name))[0], **spec, 'slurm': slurm}
+
+def read_tokamaks(csv_file):
+    '''
+    The characteristics of the tokamaks (R_0, a, B...) by name, the first column
+    '''
+    with open(csv_file, newline = '') as file:
+        reader = DictReader(file)
+        index  = reader.fieldnames[0]
+        return {row.pop(index): {key: float(value) for key, value in row.items() if value != ''} for row in reader}
+
+def points(spec):
+    '''
+    All the points of the scan, dictionaries with a value of every list of spec['scan']
+    '''
+    keys = list(spec['scan'])
+    return [dict(zip(keys, values)) for values in product(*[spec['scan'][key] for key in keys])]
+
+def run_input(spec, point, tokamaks = None):
+    '''
+    The input of FELTOR of a point of the scan: the base input of its model with
+    the parameters set, the ones of the point and the curvature and adiabatic
+    parameters, from the tokamak if the point has one
+    '''
+    model = point['model']
+    with open(spec['inputs'].format(model = model)) as file:
+        data = load(file)
+
+    T_e = point.get('T_e', spec['T_e'])
+    unit = None
+    if 'tokamak' in point:
+        unit = units(T_e = T_e, **tokamaks[point['tokamak']])
+    derived = {'kappa': None if unit == None else unit.kappa, 'alpha': None if unit == None else unit.alpha}
+
+    ## The values of the point are put before the ones set, which may be computed from them, and after, to win
+    data.update({key: value for key, value in point.items() if key not in ['model', 'tokamak', 'T_e']})
+    for key, value in spec['set'].items():
+        data[key] = eval(value[1:], {'__builtins__': {}}, dict(data)) if type(value) == str and value[:1] == '=' else value
+    data.update({key: value for key, value in point.items() if key not in ['model', 'tokamak', 'T_e']})
+
+    data['model']    = in_model[model]
+    data['modified'] = 1 if 'mod' in model else 0
+    for key, name in [('curvature', 'kappa'), ('adiabatic', 'alpha')]:
+        value = derived[name] if spec[key] == name else spec[key]
+        if value == None:
+            raise ValueError(f'{key} = {name} needs a tokamak in the scan')
+        data[key] = value if key != 'curvature' or 'IC' in model else 0
+    return data
+
+def runs(spec):
+    '''
+    The runs of the scan, dictionaries with the model, directory, input file and
+    input data. The points that give the same input as an earlier one are not run
+    again, and two different inputs with the same output raise an error (the name
+    should then include the parameter that changes).
+    '''
+    tokamaks = read_tokamaks(spec['tokamaks']) if 'tokamak' in spec['scan'] else None
+    found, outputs = {}, {}
+    for point in points(spec):
+        data      = run_input(spec, point, tokamaks)
+        directory = spec['name'].format_map({**data, 'T_e': spec['T_e'], **point})
+        key       = dumps(data, sort_keys = True)
+        output    = join(spec['outputs'], directory, f"output_{point['model']}.nc")
+        if key in found:
+            continue
+        if output in outputs:
+            raise ValueError(f'{output} is the output of two different inputs, add the parameters to the name of the scan')
+        run = {'model': point['model'], 'point': point, 'directory': directory, 'output': output, 'data': data,
+               'input': join(spec['inputs_dir'], f"input_data_{point['model']}_{directory}.json")}
+        found[key], outputs[output] = run, run
+    return list(found.values())
+
+
+#=====================================================================================
+# SLURM jobs
+#=====================================================================================
+
+def resources(spec):
+    '''
+    Tasks and cpus per task of every run, the runs that fit in a node and the
+    nodes of every run
+    '''
+    slurm = spec['slurm']
+    tasks = 1 if spec['mpi'] == None else spec['mpi']['np']
+    cores = tasks * slurm['cpus_per_task']
+    return tasks, slurm['cpus_per_task'], max(1, slurm['cores_per_node'] // cores), ceil(cores / slurm['cores_per_node'])
+
+def pack(spec, all_runs):
+    '''
+    The runs split in jobs of at most runs_per_job runs
+    '''
+    size = max(1, spec['slurm']['runs_per_job'])
+    return [all_runs[i:i + size] for i in range(0, len(all_runs), size)]
+
+def header(spec, name, nodes, tasks, cpus, info):
+    '''
+    The beginning of a job script, with the SBATCH options
+    '''
+    slurm = spec['slurm']
+    lines = ['#!/bin/bash', '', f'#SBATCH -J {name}',
+             f"#SBATCH -N {nodes} -n {tasks} -c {cpus}" + (f" --hint={slurm['hint']}" if slurm.get('hint') else '')]
+    lines += [f'#SBATCH --{option}={slurm[option]}' for option in ['partition', 'account', 'mem', 'time'] if slurm.get(option)]
+    lines += [f'#SBATCH -o "{info}"', '', 'date'] + list(spec['setup'])
+    return lines
+
+def job_script(spec, job, number):
+    '''
+    A job running the runs given, every one as an srun step of its own resources
+    in the background, so they all share the allocation
+    '''
+    tasks, cpus, per_node, run_nodes = resources(spec)
+    nodes   = ceil(len(job) / per_node) if run_nodes == 1 else len(job) * run_nodes
+    name    = simply[job[0]['model']] if len(job) == 1 else f"{spec['scan_name']}_{number}"
+    info    = join(spec['info_dir'], f"{spec['scan_name']}_job_{number}.info")
+    lines   = header(spec, name, nodes, len(job) * tasks, cpus, info)
+    mpi     = spec['mpi'] != None
+    for run in job:
+        folder  = join(spec['outputs'], run['directory'])
+        output  = join(spec['info_dir'], f"{run['model']}_{run['directory']}.info")
+        command = (f"srun --exclusive -N {run_nodes} -n {tasks} -c {cpus}" + (' --mpi=pmi2' if mpi else '') +
+                   f" -o \"{output}\" {spec['program']} \"{run['input']}\" \"{run['output']}\"" +
+                   (f" {spec['mpi']['np0']} {spec['mpi']['np1']}" if mpi else '') + ' &')
+        lines  += ['', f"mkdir -p \"{folder}\"", f"cp \"{run['input']}\" \"{folder}/\"", command]
+    return '\n'.join(lines + ['', 'wait', 'date', ''])
+
+def gif_script(spec, directory, models):
+    '''
+    A job making the GIFs of the models of a directory with GIF_main_mpi,
+    one processor per model
+    '''
+    n     = len(models)
+    info  = join(spec['info_dir'], f'GIF_{directory}.info')
+    lines = header(spec, 'GIFs', ceil(n / 2), n, spec['slurm']['cores_per_node'] // 2, info)
+    lines += [f"srun --mpi=pmi2 python \"{spec['gif_program']}\" \"{join(spec['outputs'], directory)}/\" \"{directory}/\""]
+    return '\n'.join(lines + ['', 'date', ''])
+
+
+#=====================================================================================
+# Engine
+#=====================================================================================
+
+def write(spec, dry_run = False):
+    '''
+    Write the inputs of the runs, the jobs and the script submitting them
+    (the GIF jobs depend on the jobs of their runs). Gives the runs and the
+    names of the submission script and of the job scripts.
+    '''
+    all_runs = runs(spec)
+    jobs     = pack(spec, all_runs)
+    name     = spec['scan_name']
+    scripts  = {join(spec['submit_dir'], f'{name}_job_{number}.sh'): job_script(spec, job, number)
+                for number, job in enumerate(jobs)}
+
+    submit = ['#!/bin/bash', f'## Jobs of the scan {name}']
+    for number, script in enumerate(scripts):
+        submit.append(f'job_{number}=$(sbatch --parsable {script})')
+    if spec['gif']:
+        for directory in dict.fromkeys(run['directory'] for run in all_runs):
+            numbers = [number for number, job in enumerate(jobs) if any(run['directory'] == directory for run in job)]
+            models  = [run['model'] for run in all_runs if run['directory'] == directory]
+            script  = join(spec['submit_dir'], f'{name}_GIF_{directory}.sh')
+            scripts[script] = gif_script(spec, directory, models)
+            submit.append(f"sbatch --dependency=afterok:{':'.join(f'$job_{number}' for number in numbers)} {script}")
+    submit_name = join(spec['submit_dir'], f'{name}_submit.sh')
+
+    if not dry_run:
+        makedirs(spec['inputs_dir'], exist_ok = True)
+        makedirs(spec['submit_dir'], exist_ok = True)
+        makedirs(spec['info_dir'],   exist_ok = True)
+        for run in all_runs:
+            with open(run['input'], 'w') as file:
+                dump(run['data'], file, indent = 1)
+        for script, text in {**scripts, submit_name: '\n'.join(submit) + '\n'}.items():
+            with open(script, 'w') as file:
+                file.write(text)
+
+    return all_runs, submit_name, list(scripts)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description = 'Write the inputs and SLURM jobs of a parameter scan of FELTOR')
+    parser.add_argument('spec', help = 'json file with the spec of the scan')
+    parser.add_argument('--dry-run', action = 'store_true', help = 'only list the runs and jobs')
+    parser.add_argument('--submit', action = 'store_true', help = 'submit the jobs with sbatch')
+    arguments = parser.parse_args()
+
+    spec = load_spec(arguments.spec)
+    all_runs, submit_name, scripts = write(spec, arguments.dry_run)
+    for run in all_runs:
+        print(f"{run['model']:10s} {run['directory']}")
+    print(f'{len(points(spec)) - len(all_runs)} points of the scan repeat the input of another one')
+    print(f'{len(all_runs)} runs in {len([script for script in scripts if "_job_" in script])} jobs, submitted by {submit_name}')
+    if arguments.submit and not arguments.dry_run:
+        call(['bash', submit_name])
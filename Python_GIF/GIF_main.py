@@ -1,4 +1,5 @@
-from GIF_modules import Analyzed, animate, init
+from GIF_modules import Analyzed, init_persistent, animate_persistent
+from Instrument  import recorder, stage
 from datetime    import datetime
 from os.path     import join, exists, isdir
 from os          import remove
@@ -47,6 +48,7 @@ for model in models:
     if exists(info_file):
         remove(info_file)
 
+    recorder.reset()
     start     = time()
     File_name = join(dir_name, f'output_{model}.nc')
     existance = exists(File_name)
@@ -71,28 +73,31 @@ for model in models:
         information.write('+' * 50 + "\n")
 
 
-    ## Generate the init function for the GIF, it needs the model the fig and the parameters
-    init_    = lambda : init(model = model, Analytics = Analytics, ax = ax, fig = fig, extra = extra)
-    animate_ = lambda pos, An, a: animate(pos, An, a, fig = fig)
+    ## The figure is drawn once, the frames only update the data of the artists
+    artists  = init_persistent(model = model, Analytics = Analytics, ax = ax, fig = fig, extra = extra)
+    init_    = lambda : artists['meshes'] + artists['markers'] + artists['notes']
+    animate_ = lambda pos, An: animate_persistent(pos, An, artists)
 
     ## We define the format for writing the mp4 file
     Writer = writers['ffmpeg']
     writer = Writer(fps=fps, metadata=dict(artist='Me'), bitrate = 600)
 
     ## We define the animation class and we save the animation, or show it
-    ani = FuncAnimation(fig, animate_, np.arange(0, len(Analytics.ions), i),
-                                  fargs = (Analytics, ax),
-                                  init_func=init_, interval = 100) ## np.arange(1, len(Analytics.ions))
+    ani = FuncAnimation(fig, animate_, arange(0, len(Analytics.ions), i),
+                                  fargs = (Analytics,),
+                                  init_func=init_, interval = 100, blit = True) ## arange(1, len(Analytics.ions))
 
-    ani.save(GIF_name)
+    with stage('save'):   ## Every frame is drawn and encoded here
+        ani.save(GIF_name)
     # show()
     clf()
 
     stop   = time()
     needed = stop - start
     nd_hr  = floor(needed / 3600)
-    nd_mn  = remainder(needed, 3600) * 60
+    nd_mn  = remainder(needed, 3600) / 60
     with open(info_file, 'a') as information:
         information.write('After {} h and {:.1f} min, I am done with model: {}'.format(nd_hr, nd_mn, model + extra) + 2 * "\n")
+    recorder.dump(join(dir_name, f"profile_{model + extra}.json"), model = model + extra)
 
 print('Done')
@@ -1,15 +1,15 @@
-from GIF_modules import Analyzed, animate, init, Flux_plot
+from GIF_modules import Analyzed, init_persistent, Flux_plot, render_frames, assemble_frames
+from Instrument  import recorder, stage
 from datetime    import datetime
 from os.path     import join, exists, isdir
-from os          import remove, listdir
+from os          import remove, listdir, mkdir
 from sys         import argv
 from time        import time
-from numpy       import arange
+from numpy       import arange, array_split
 from warnings    import warn
 from mpi4py      import MPI
 
 from matplotlib.pyplot    import clf, show, subplots, savefig
-from matplotlib.animation import writers, FuncAnimation
 from matplotlib           import use
 
 #from moviepy.editor import VideoFileClip
@@ -63,74 +63,88 @@ if size < len(models):
     print(f'Not all the videos will be created, size = {size} out of {len(models)}')
     print(f' The program will not process {models[size:]}')
 
-if rank < len(models):
-    model = models[rank]
-    print(f'Hello, I am processor {name} and I will take care of model: {model}.\n I hope I do it properly')
-    GIF_name = join(dir_name, f'video_{model + extra}')
-    GIF_name += '.mp4' if wrtr =='ffmpeg' else '.gif'
-    #if exists(GIF_name):
-        # overwrite = input("The GIF file already exists, do you wanna overwrite it?([Y]/n)\n")
-    #   overwrite = 'Y'
-    #   if overwrite not in ['y', 'ye', 'yes', 'Y', 'YE', 'YES', '']:
-        # GIF_name = input('Please, give a new name')
-    #       if GIF_name == '':
+## Every model gets a group of processors, which split the frames of its animation
+n_groups     = min(size, len(models))
+color        = rank % n_groups
+group        = comm.Split(color, rank)
+g_rank       = group.Get_rank()
+g_size       = group.Get_size()
+
+model = models[color]
+print(f'Hello, I am processor {name} and I will take care of model: {model} ({g_rank + 1} out of {g_size}).\n I hope I do it properly')
+GIF_name = join(dir_name, f'video_{model + extra}')
+GIF_name += '.mp4' if wrtr =='ffmpeg' else '.gif'
+#if exists(GIF_name):
+    # overwrite = input("The GIF file already exists, do you wanna overwrite it?([Y]/n)\n")
+#   overwrite = 'Y'
+#   if overwrite not in ['y', 'ye', 'yes', 'Y', 'YE', 'YES', '']:
+    # GIF_name = input('Please, give a new name')
+#       if GIF_name == '':
 #           raise Exception('We need a name for the GIF')
-    print('Looking for the info')
-    info_file = join(dir_name, f"info_{model + extra}.txt")
-    if exists(info_file):
-        remove(info_file)
-
-    start     = time()
-    File_name = join(dir_name, f'output_{model}.nc')
-    existance = exists(File_name)
-    print('The time has started')
-    if not existance:
+print('Looking for the info')
+info_file = join(dir_name, f"info_{model + extra}.txt")
+if g_rank == 0 and exists(info_file):
+    remove(info_file)
+
+start     = time()
+File_name = join(dir_name, f'output_{model}.nc')
+existance = exists(File_name)
+print('The time has started')
+if not existance:
+    if g_rank == 0:
         with open(info_file, 'a') as information:
             information.write(f'{File_name} does not exist.')
-        raise Exception('The output file does not exit.')
+    raise Exception('The output file does not exit.')
 
-    ## We analysis the file and obtain the values we wanna measure
-    print('Analysing the file')
-    Analytics = Analyzed(File_name)
-    print(f'The length of the output is {Analytics.nt}')
+## We analysis the file and obtain the values we wanna measure, every processor of the group reads a part
+print('Analysing the file')
+Analytics = Analyzed(File_name, parallel = group)
+print(f'The length of the output is {Analytics.nt}')
+
+## The frames of the animation, and the chunk this processor renders
+frames    = arange(0, len(Analytics.ions), i)
+numbers   = array_split(arange(len(frames)), g_size)[g_rank]
+frame_dir = join(dir_name, f'frames_{model + extra}')
+
+if g_rank == 0:
     with open(info_file, 'a') as information:
         information.write('+' * 50 + "\n")
-        information.write(f'model: {model + extra}, with {len(Analytics.ions) // i} out of {len(Analytics.ions)} points in the GIF' + "\n")
+        information.write(f'model: {model + extra}, with {len(frames)} out of {len(Analytics.ions)} points in the GIF' + "\n")
+        information.write(f'The frames are rendered by {g_size} processors' + "\n")
         information.write(f'The times goes from {Analytics.time[0]} to {Analytics.time[-1]}' + "\n")
         information.write('+' * 50 + "\n")
         information.write(f'The file started at {datetime.now()}'+ '\n')
         information.write('+' * 50 + "\n")
 
-    ## Flux
-    print('I am going for the Flux')
-    fig, ax = subplots(2, figsize=(24, 15))
-    fig, ax = Flux_plot(Analytics, ax, fig, model = model)
-    Flux_name = join(dir_name, f'Flux_{model + extra}.jpeg') 
-    savefig(Flux_name)
-    clf()
+## Flux, its profile is computed by all the processors of the group and saved by the first one
+print('I am going for the Flux')
+fig, ax = subplots(2, figsize=(24, 15))
+fig, ax = Flux_plot(Analytics, ax, fig, model = model)
+if g_rank == 0:
+    Flux_name = join(dir_name, f'Flux_{model + extra}.jpeg')
+    with stage('Flux_save'):
+        savefig(Flux_name)
     print('The Flux is saved after {:1.2f} seconds'.format(time() - start))
 
+    if not isdir(frame_dir):
+        mkdir(frame_dir)
+clf()
+group.Barrier()
 
-    ## Initiation of the figure
-    fig, ax = subplots(2, 3, figsize=(32, 18),
-                       gridspec_kw={'height_ratios':[Analytics.lx / Analytics.ly, 1]})
-
-    ## Generate the init function for the GIF, it needs the model the fig and the parameters
-    init_    = lambda : init(model = model, Analytics = Analytics, ax = ax, fig = fig, extra = extra, colormap = clrmp, log_n = log_n)
-    animate_ = lambda pos, An, a: animate(pos, An, a, fig = fig)
+## Initiation of the figure
+fig, ax = subplots(2, 3, figsize=(32, 18),
+                   gridspec_kw={'height_ratios':[Analytics.lx / Analytics.ly, 1]})
 
-    ## We define the format for writing the mp4 file
-    Writer = writers[wrtr]
-    writer = Writer(fps=fps, metadata=dict(artist='Me')) #, bitrate = 600
+## Every processor renders its frames as images, only the data of the fields and markers changes
+artists = init_persistent(model = model, Analytics = Analytics, ax = ax, fig = fig, extra = extra, colormap = clrmp, log_n = log_n)
+render_frames(frames[numbers], numbers, Analytics, ax, fig, frame_dir, artists = artists)
+clf()
+print(f'Processor {name} rendered {len(numbers)} frames after {time() - start:1.2f} seconds')
 
-    ## We define the animation class and we save the animation, or show it
-    ani = FuncAnimation(fig, animate_, arange(0, len(Analytics.ions), i),
-                        fargs = (Analytics, ax),
-                        init_func=init_, interval = 100) ## arange(1, len(Analytics.ions))
-
-    ani.save(GIF_name)
-    # show()
-    clf()
+## When all the chunks are done, they are put together in order
+group.Barrier()
+if g_rank == 0:
+    assemble_frames(frame_dir, len(frames), GIF_name, writer = wrtr, fps = fps)
 
 #    clip = VideoFileClip(GIF_name)
 #    clip.write_videofile(GIF_name.replace(".gif", ".mp4"))
@@ -142,3 +156,6 @@ if rank < len(models):
     with open(info_file, 'a') as information:
         information.write('After {} h and {:.1f} min, I am done with model: {}'.format(nd_hr, nd_mn, model + extra) + 2 * "\n")
     print('After {} h and {:.1f} min, I am done with model: {}'.format(nd_hr, nd_mn, model + extra) + 2 * "\n")
+
+## The measures of the stages of all the processors of the model, in a json next to the outputs
+recorder.dump(join(dir_name, f"profile_{model + extra}.json"), group, model = model + extra, processors = g_size)
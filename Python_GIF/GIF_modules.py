@@ -2,8 +2,14 @@ from sys import path
 path.insert(1, '/m100/home/userexternal/crodrigu/Plasma/Feltor_2D_Master_Thesis/2D_FELTOR_Analysis/')
 
 from Analysis          import Analyse
-from numpy             import amax, amin, absolute, log, gradient
+from Instrument        import timed, stage, count
+from numpy             import amax, amin, absolute, log
+from os                import remove, rmdir
+from os.path           import join
+from subprocess        import check_call
+from PIL               import Image
 from matplotlib        import use
+from matplotlib.collections import QuadMesh
 use("Agg")
 
 ftsz_title_big = 27
@@ -25,38 +31,66 @@ min_v_r,          max_v_r          = 0, 0
 
 amp_ions, amp_potential, amp_vorticity = 0, 0, 0
 
-def Analyzed (File_name):
+@timed('Analyzed')
+def Analyzed (File_name, cache = None, parallel = False):
     '''
     A function to get the parameters we want to plot, CM, error in Mass, Velocity of the
     CM, Potential, density and vorticity-
+    With cache = True (or the directory to use), the values are kept in the sidecar cache
+    of the output (see Cache.py), under gif/ (also the ones of Flux_plot) since the fields
+    here are the ones of the file, without the background density or the sign of the
+    potential of Analyse
+    With parallel = True (or an MPI communicator) every rank reads its part of the time
+    steps and all of them get the values, see Analyse
     '''
 
 #    global min_time, min_int_vort, min_Mass, min_int_vort_sqr
 #    global max_time, max_int_vort, max_Mass, max_int_vort_sqr
     global min_ions, min_potential, min_vorticity, min_v_r
     global max_ions, max_potential, max_vorticity, max_v_r
-    global amp_ions, max_potential, amp_vorticity, amp_int_vrad
-
-    Analytics = Analyse(File_name, input_model = True, dimensions = True, fields = False, get_everything = False, integrate_fields = False)
-
-    Analytics.v_r          = -gradient(Analytics.Data['potential'][:], Analytics.y, axis = 1).transpose()
-    Analytics.V_r          = Analytics.integrate(Analytics.v_r) / (Analytics.lx * Analytics.ly)
-    Analytics.Mass         = Analitics.integrate(Analytics.Data['ions'][:]) / (Analytics.lx * Analytics.ly)
-    Analytics.int_vort_sqr = Analytics.integrate(Analytics.Data['vorticity'][:] ** 2) / (Analytics.lx * Analytics.ly)
-
-    min_ions      = amin(Analytics.Data['ions'][:]);      max_ions      = amax(Analytics.Data['ions'][:])
-    min_potential = amin(Analytics.Data['potential'][:]); max_potential = amax(Analytics.Data['potential'][:])
-    min_vorticity = amin(Analytics.Data['vorticity'][:]); max_vorticity = amax(Analytics.Data['vorticity'][:])
-    min_v_r       = amin(Analytics.v_r);           max_v_r       = amax(Analytics.v_r)
-
-    amp_Mass      = max(absolute(min_ions), absolute(min_ions))
-    amp_potential = max(absolute(min_potential), absolute(max_potential))
-    amp_vorticity = max(absolute(min_vorticity), absolute(max_vorticity))
+    global amp_ions, amp_potential, amp_vorticity, amp_int_vrad
+
+    Analytics = Analyse(File_name, input_model = True, dimensions = True, fields = False, get_everything = False, integrate_fields = False, cache = cache, parallel = parallel)
+    Analytics.namespace = 'gif/'
+    if Analytics.nt < 2:
+        raise ValueError('The field contains only the initial conditions')
+
+    ## The fields are read from the file by blocks of time steps, all of them in a single pass
+    Analytics.ions      = Analytics.field('ions')
+    Analytics.potential = Analytics.field('potential')
+    Analytics.vorticity = Analytics.field('vorticity')
+    Analytics.v_r       = Analytics.velocity('r', Analytics.potential)
+
+    def statistics():
+        stats = Analytics.reduce({'ions': Analytics.ions, 'potential': Analytics.potential,
+                                  'vorticity': Analytics.vorticity, 'v_r': Analytics.v_r})
+        return [stats['v_r']['integral']           / (Analytics.lx * Analytics.ly),
+                stats['ions']['integral']          / (Analytics.lx * Analytics.ly),
+                stats['vorticity']['integral_sqr'] / (Analytics.lx * Analytics.ly)] + \
+               [stats[name][value] for name in ['ions', 'potential', 'vorticity', 'v_r'] for value in ['min', 'max', 'amp']]
+
+    names = ['V_r', 'Mass', 'int_vort_sqr'] + [f'{value}_{name}' for name in ['ions', 'potential', 'vorticity', 'v_r']
+                                                                  for value in ['min', 'max', 'amp']]
+    values = dict(zip(names, Analytics.cached(names, statistics)))
+
+    Analytics.V_r          = values['V_r']
+    Analytics.Mass         = values['Mass']
+    Analytics.int_vort_sqr = values['int_vort_sqr']
+
+    min_ions      = values['min_ions'];      max_ions      = values['max_ions']
+    min_potential = values['min_potential']; max_potential = values['max_potential']
+    min_vorticity = values['min_vorticity']; max_vorticity = values['max_vorticity']
+    min_v_r       = values['min_v_r'];       max_v_r       = values['max_v_r']
+
+    amp_ions      = values['amp_ions']
+    amp_potential = values['amp_potential']
+    amp_vorticity = values['amp_vorticity']
     amp_int_vrad  = max(absolute(amax(Analytics.V_r)), absolute(amin(Analytics.V_r)))
 
 
     return Analytics
 
+@timed('frame_update')
 def animate (position, Analytics, ax, fig):
     '''
     A function to update each frame
@@ -84,22 +118,6 @@ def animate (position, Analytics, ax, fig):
     ## or boundaries, we will make them visible
     ## This happens because we wanna put the colorbar from the begining
 
-    # Plots
-    ## Radial Velocity
-    ax[0, 0].plot(time_pos, Analytics.V_r[position], 'o', color='tab:red')
-    ax[0, 0].annotate(round(time_pos, 1), (time_pos, Analytics.V_r[position]), fontsize = ftsz_label)
-
-	## Mass
-    ax[0, 1].plot(time_pos, Analytics.Mass[position], 'o',  color='tab:red')
-    ax[0, 1].annotate(round(time_pos, 1), (time_pos, Analytics.Mass[position]), fontsize = ftsz_label)
-
-	## Integrated Vorticity square ** 2
-    ax[0, 2].plot(time_pos, Analytics.int_vort_sqr[position], 'o', color='tab:red')
-    ax[0, 2].annotate(round(time_pos, 1), (time_pos, Analytics.int_vort_sqr[position]), fontsize = ftsz_label)
-
-
-
-
     return ax
 
 
@@ -187,20 +205,128 @@ def init(Analytics, ax, fig, model, extra = '', pst = 0, suptitle = True, colorm
 
     return ax
 
+#=====================================================================================
+# Animation keeping the artists
+#=====================================================================================
+
+def init_persistent(Analytics, ax, fig, model, extra = '', suptitle = True, colormap = 'seismic', colormap_n = 'hot', log_n = True):
+    '''
+    Initialization of the plots as in init, but everything is drawn only once.
+    The artists that change with the frames (the pcolormesh of the fields and the
+    markers and annotations of the time series) are returned, so animate_persistent
+    only has to update their data. They are animated, so they can be blitted.
+    '''
+
+    ax = init(Analytics, ax, fig, model, extra, pst = 0, suptitle = suptitle,
+              colormap = colormap, colormap_n = colormap_n, log_n = log_n)
+    log_n = log_n and min_ions >= 0
+
+    ## The colorbars are fixed for the whole animation
+    min_n = log(min_ions) if log_n else min_ions
+    max_n = log(max_ions) if log_n else max_ions
+    meshes = [[artist for artist in ax[1, i].collections if isinstance(artist, QuadMesh)][-1] for i in range(3)]
+    meshes[0].set_clim(vmin = -amp_potential, vmax = amp_potential)
+    meshes[1].set_clim(vmin =  min_n,         vmax = max_n)
+    meshes[2].set_clim(vmin = -amp_vorticity, vmax = amp_vorticity)
+
+    time_pos = Analytics.time[0]
+    markers, notes = [], []
+    for i, series in enumerate([Analytics.V_r, Analytics.Mass, Analytics.int_vort_sqr]):
+        markers += ax[0, i].plot(time_pos, series[0], 'o', color='tab:red', animated = True)
+        notes.append(ax[0, i].annotate(round(time_pos, 1), (time_pos, series[0]), fontsize = ftsz_label, animated = True))
+
+    for mesh in meshes:
+        mesh.set_animated(True)
+
+    return {'meshes': meshes, 'markers': markers, 'notes': notes, 'log_n': log_n}
+
+@timed('frame_update')
+def animate_persistent (position, Analytics, artists):
+    '''
+    A function to update each frame, changing only the data of the artists
+    given by init_persistent. It returns the artists changed, for blitting.
+    '''
+    time_pos = Analytics.time[position]
+    for i, series in enumerate([Analytics.V_r, Analytics.Mass, Analytics.int_vort_sqr]):
+        artists['markers'][i].set_data([time_pos], [series[position]])
+        artists['notes'][i].set_text(round(time_pos, 1))
+        artists['notes'][i].xy    = (time_pos, series[position])
+        artists['notes'][i].xyann = (time_pos, series[position])
+
+    frame  = {name: Analytics.Data[name][position] for name in ['ions', 'potential', 'vorticity']}
+    count(sum(values.nbytes for values in frame.values()))
+    n_ions = log(frame['ions']) if artists['log_n'] else frame['ions']
+
+    artists['meshes'][0].set_array(frame['potential'])
+    artists['meshes'][1].set_array(n_ions)
+    artists['meshes'][2].set_array(frame['vorticity'])
+
+    return artists['meshes'] + artists['markers'] + artists['notes']
+
+#=====================================================================================
+# Rendering the frames in parallel
+#=====================================================================================
+
+def frame_name(directory, number):
+    '''
+    Name of the image of the frame number of the animation
+    '''
+    return join(directory, f'frame_{number:06d}.png')
+
+def render_frames(positions, numbers, Analytics, ax, fig, directory, artists = None):
+    '''
+    Render the frames at the given positions of the output as png images, numbered
+    as they will be in the animation. In this way, several processors can render
+    different chunks of the frames and assemble_frames put them together in order.
+    init should have been called before, as with FuncAnimation, or init_persistent,
+    whose artists are then updated with animate_persistent.
+    '''
+    for number, position in zip(numbers, positions):
+        if artists == None:
+            animate(position, Analytics, ax, fig)
+        else:
+            animate_persistent(position, Analytics, artists)
+        with stage('frame_render'):
+            fig.savefig(frame_name(directory, number))
+
+@timed('assemble_frames')
+def assemble_frames(directory, n_frames, name, writer = 'pillow', fps = 5):
+    '''
+    Put the n_frames images of render_frames together in the GIF (pillow) or mp4 (ffmpeg)
+    file name. The images are lossless, so the result is the same as if the frames
+    were rendered one after the other by FuncAnimation. The images are removed at the end,
+    only if the file was written (if ffmpeg fails CalledProcessError is raised).
+    '''
+    if writer == 'ffmpeg':
+        check_call(['ffmpeg', '-y', '-framerate', str(fps), '-i', join(directory, 'frame_%06d.png'),
+                    '-vcodec', 'h264', '-pix_fmt', 'yuv420p', '-vf', 'scale=trunc(iw/2)*2:trunc(ih/2)*2', name])
+    else:
+        ## The frames are opened one by one while the GIF is written
+        first = Image.open(frame_name(directory, 0))
+        first.save(name, save_all = True, loop = 0, duration = int(1000 / fps),
+                   append_images = (Image.open(frame_name(directory, number)) for number in range(1, n_frames)))
+
+    for number in range(n_frames):
+        remove(frame_name(directory, number))
+    rmdir(directory)
+
 #=====================================================================================
 # Plotting Fluxes
 #=====================================================================================
 
+@timed('Flux_plot')
 def Flux_plot(Analitics, ax, fig, model = None, extra = '',  suptitle = True):
     '''
     Plot the Average Flux, it should be kind of constant in the inner region between
     the source and the LCFS
     '''
     hlf   = Analitics.nt // 2
-    Gamma = Analitics.integrate(Analitics.ions[hlf:] * Analitics.v_r[hlf:], dim_integral = 1, axis = -1, typ = 'y') / Analitics.ly
-    n_yt  = Analitics.integrate(Analitics.ions[hlf:],                       dim_integral = 1, axis = -1, typ = 'y') / Analitics.ly
-    Gamma = Analitics.integrate(Gamma, typ = 't', axis = 0, dim_integral = 1, indep_vars = [Analitics.time[hlf:]]) / (Analitics.time[-1] - Analitics.time[hlf])
-    n_yt  = Analitics.integrate(n_yt,  typ = 't', axis = 0, dim_integral = 1, indep_vars = [Analitics.time[hlf:]]) / (Analitics.time[-1] - Analitics.time[hlf])
+
+    def profiles():
+        flux = Analitics.flux_profile(hlf)
+        return [flux['Gamma'], flux['n']]
+
+    Gamma, n_yt = Analitics.cached([f'Gamma_{hlf}', f'n_yt_{hlf}'], profiles)
 
     if suptitle:
         fig.suptitle(models_name[model] + '\n' + r'lx = {} ly = {} $\nu$ = {} dt = {:1.3f}'.